@@ -1,43 +1,284 @@
-import pandas as pd
-from fuzzywuzzy import fuzz, process
-from openpyxl import load_workbook
-from openpyxl.styles import PatternFill, Alignment
-from openpyxl.utils import get_column_letter
+import time
+PROGRAM_START = time.perf_counter()  # Момент запуска программы, до импорта остальных модулей
+
 import tkinter as tk
 from tkinter import filedialog, messagebox
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import hashlib
+import heapq
+import json
+import math
+import multiprocessing
+import threading
 import warnings
 import os
+import re
 import sys
-import time
+
+# Время импорта модулей уровня модуля (tkinter и стандартная библиотека)
+MODULE_IMPORT_TIME = time.perf_counter() - PROGRAM_START
 
 # Отключаем все предупреждения
 warnings.filterwarnings('ignore')
 
-# Цвета для заливки
-GREEN_FILL = PatternFill(start_color='C6EFCE', end_color='C6EFCE', fill_type='solid')  # Светло-зеленый
-YELLOW_FILL = PatternFill(start_color='FFEB9C', end_color='FFEB9C', fill_type='solid')  # Светло-желтый
-RED_FILL = PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid')  # Светло-красный
+# Тяжелые модули (pandas, fuzzywuzzy, openpyxl) загружаются в фоновом потоке,
+# пока пользователь работает с окном настроек. См. start_background_loading()
+pd = None
+fuzz = None
+fuzz_utils = None
+Levenshtein = None
+load_workbook = None
+PatternFill = None
+Alignment = None
+get_column_letter = None
+
+# Цвета для заливки (создаются после загрузки openpyxl)
+GREEN_FILL = None  # Светло-зеленый
+YELLOW_FILL = None  # Светло-желтый
+RED_FILL = None  # Светло-красный
 
 # Стиль выравнивания по центру
-CENTER_ALIGNMENT = Alignment(horizontal='center', vertical='center')
+CENTER_ALIGNMENT = None
+
+# Имя листа со сводной статистикой при обработке нескольких листов
+STATS_SHEET_NAME = 'Статистика'
+
+# Способы распределения совпадений между записями ЗУП и портала
+ASSIGNMENT_GREEDY = 'greedy'  # Записи ЗУП по порядку забирают лучшее оставшееся ФИО портала
+ASSIGNMENT_OPTIMAL = 'optimal'  # Максимальный суммарный процент совпадения по всем записям
+
+# Пороги отчета по подбору порога; оценки пар сохраняются начиная с наименьшего из них
+SWEEP_THRESHOLDS = tuple(range(50, 101))
+
+# Минимальная доля fuzz.ratio фамилий и имен, при которой пара может пройти правила score_pair (80 с округлением)
+MIN_WORD_RATIO = 0.795
+
+# Время импорта модулей в секундах: модули уровня модуля и каждый тяжелый модуль
+IMPORT_TIMES = {'tkinter и stdlib': MODULE_IMPORT_TIME}
+
+_modules_loaded = threading.Event()
+_loader_thread = None
+_loader_error = None
+
+
+@contextmanager
+def _import_timer(name):
+    """Замеряет время импорта модуля и сохраняет его в IMPORT_TIMES"""
+    start = time.perf_counter()
+    yield
+    IMPORT_TIMES[name] = time.perf_counter() - start
+
+
+def load_heavy_modules():
+    """Импортирует pandas, fuzzywuzzy и openpyxl и создает стили оформления"""
+    global pd, fuzz, fuzz_utils, Levenshtein, load_workbook, PatternFill, Alignment, get_column_letter
+    global GREEN_FILL, YELLOW_FILL, RED_FILL, CENTER_ALIGNMENT, _loader_error
+
+    # Импорты записаны явно, чтобы auto-py-to-exe включил модули в сборку
+    try:
+        with _import_timer('pandas'):
+            import pandas
+        with _import_timer('fuzzywuzzy'):
+            from fuzzywuzzy import fuzz as fuzz_module, utils as fuzz_utils_module
+        with _import_timer('Levenshtein'):
+            import Levenshtein as levenshtein_module
+        with _import_timer('openpyxl'):
+            import openpyxl
+        with _import_timer('openpyxl.styles'):
+            from openpyxl.styles import PatternFill as pattern_fill, Alignment as alignment
+        with _import_timer('openpyxl.utils'):
+            from openpyxl.utils import get_column_letter as column_letter
+
+        pd = pandas
+        fuzz = fuzz_module
+        fuzz_utils = fuzz_utils_module
+        Levenshtein = levenshtein_module
+        load_workbook = openpyxl.load_workbook
+        PatternFill = pattern_fill
+        Alignment = alignment
+        get_column_letter = column_letter
+
+        GREEN_FILL = PatternFill(start_color='C6EFCE', end_color='C6EFCE', fill_type='solid')
+        YELLOW_FILL = PatternFill(start_color='FFEB9C', end_color='FFEB9C', fill_type='solid')
+        RED_FILL = PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid')
+        CENTER_ALIGNMENT = Alignment(horizontal='center', vertical='center')
+    except Exception as e:
+        _loader_error = e
+    finally:
+        _modules_loaded.set()
+
+
+def start_background_loading():
+    """Запускает загрузку тяжелых модулей в фоновом потоке"""
+    global _loader_thread
+    if _loader_thread is None and not _modules_loaded.is_set():
+        _loader_thread = threading.Thread(target=load_heavy_modules, name='module-loader', daemon=True)
+        _loader_thread.start()
+
+
+def wait_for_heavy_modules():
+    """Дожидается загрузки тяжелых модулей (или загружает их сразу, если фон не запускался)"""
+    if not _modules_loaded.is_set():
+        if _loader_thread is None:
+            load_heavy_modules()
+        else:
+            _loader_thread.join()
+    if _loader_error is not None:
+        raise ImportError(f"Не удалось загрузить модули: {_loader_error}")
+
+
+def format_import_report():
+    """Возвращает текстовый отчет о времени импорта модулей"""
+    lines = ["Время загрузки модулей:"]
+    for name, seconds in sorted(IMPORT_TIMES.items(), key=lambda item: item[1], reverse=True):
+        lines.append(f"  {name:<20} {seconds * 1000:8.1f} мс")
+    lines.append(f"  {'итого':<20} {sum(IMPORT_TIMES.values()) * 1000:8.1f} мс")
+    return '\n'.join(lines)
+
+
+# Латинские буквы, которые в ФИО выглядят как кириллические (после приведения к нижнему регистру)
+LATIN_LOOKALIKES = str.maketrans('aeopcxykmthb', 'аеорсхукмтнв')
+
+# Разные виды тире в двойных фамилиях
+DASHES = str.maketrans({'‐': '-', '‑': '-', '‒': '-', '–': '-', '—': '-', '−': '-'})
 
+CYRILLIC_VOWELS = 'аеёиоуыэюя'
+VOICELESS_CONSONANTS = 'пфктшсхцчщ'
+DEVOICING = str.maketrans('бздвгж', 'пстфкш')
+METAPHONE_VOWELS = str.maketrans({'о': 'а', 'ы': 'а', 'я': 'а', 'е': 'и', 'ё': 'и', 'э': 'и', 'ю': 'у',
+                                  'ъ': None, 'ь': None})
 
-def normalize_name(fio):
+
+def _normalize_latin(text):
+    """Заменяет латинские буквы-двойники на кириллические в словах, где есть кириллица"""
+    words = []
+    for word in text.split(' '):
+        if any('а' <= ch <= 'я' or ch == 'ё' for ch in word):
+            word = word.translate(LATIN_LOOKALIKES)
+        words.append(word)
+    return ' '.join(words)
+
+
+def _normalize_hyphens(text):
+    """Приводит двойные фамилии к виду 'петров-водкин' (без пробелов вокруг дефиса)"""
+    return re.sub(r'\s*-\s*', '-', text.translate(DASHES))
+
+
+# Шаги нормализации ФИО. Порядок в конвейере важен: 'lower' должен идти первым
+NORMALIZERS = {
+    'lower': str.lower,
+    'yo': lambda text: text.replace('ё', 'е'),
+    'latin': _normalize_latin,
+    'hyphen': _normalize_hyphens,
+    'whitespace': lambda text: ' '.join(text.split()),
+}
+
+
+def ru_metaphone(word):
+    """
+    Фонетический код слова по упрощенному русскому метафону:
+    гласные сводятся к 'а', 'и', 'у', звонкие согласные оглушаются в конце слова
+    и перед глухими, 'тс'/'дс' заменяется на 'ц', повторы букв схлопываются
+    """
+    word = ''.join(ch for ch in word.lower() if 'а' <= ch <= 'я' or ch == 'ё')
+    for sequence in ('йо', 'ио', 'йе', 'ие'):
+        word = word.replace(sequence, 'и')
+    word = word.translate(METAPHONE_VOWELS)
+
+    chars = []
+    for i, ch in enumerate(word):
+        next_ch = word[i + 1] if i + 1 < len(word) else ''
+        if not next_ch or next_ch in VOICELESS_CONSONANTS:
+            ch = ch.translate(DEVOICING)
+        chars.append(ch)
+    word = ''.join(chars).replace('тс', 'ц')
+
+    code = []
+    for ch in word:
+        if not code or code[-1] != ch:
+            code.append(ch)
+    return ''.join(code)
+
+
+# Фонетические кодировщики частей ФИО
+PHONETIC_ENCODERS = {
+    'ru_metaphone': ru_metaphone,
+}
+
+# Настройки конвейера по умолчанию:
+# normalizers - шаги из NORMALIZERS, order_insensitive - считать точным совпадение с другим порядком частей,
+# phonetic - кодировщик из PHONETIC_ENCODERS (None - без фонетического сравнения)
+DEFAULT_PIPELINE = {
+    'normalizers': ('lower', 'yo', 'latin', 'hyphen', 'whitespace'),
+    'order_insensitive': True,
+    'phonetic': None,
+}
+
+
+def is_missing(value):
+    """Проверяет, пустое ли значение ячейки (None, NaN, NaT, pd.NA); работает без загрузки pandas"""
+    if value is None:
+        return True
+    try:
+        return bool(value != value)
+    except TypeError:
+        # pd.NA не приводится к bool
+        return True
+
+
+def normalize_name(fio, normalizers=DEFAULT_PIPELINE['normalizers']):
     """Нормализует ФИО для сравнения"""
-    if pd.isna(fio):
+    if is_missing(fio):
         return ''
-    # Приводим к нижнему регистру и удаляем лишние пробелы
-    return ' '.join(str(fio).lower().split())
+    text = str(fio)
+    for name in normalizers:
+        text = NORMALIZERS[name](text)
+    return text
+
+
+def name_keys(fio, pipeline):
+    """
+    Считает для ФИО нормализованную строку, части и ключи сравнения:
+    exact_key - ключ точного совпадения, phonetic_key - фонетический ключ (или None)
+    """
+    normalized = normalize_name(fio, pipeline['normalizers'])
+    parts = normalized.split()
+    key_parts = sorted(parts) if pipeline['order_insensitive'] else parts
+
+    phonetic_key = None
+    if pipeline['phonetic']:
+        encode = PHONETIC_ENCODERS[pipeline['phonetic']]
+        # Части без кириллицы кодируются пустой строкой и в ключ не входят
+        codes = [code for code in (encode(part) for part in key_parts) if code]
+        phonetic_key = ' '.join(codes) or None
+
+    return {
+        'normalized': normalized,
+        'parts': parts,
+        'exact_key': ' '.join(key_parts),
+        'phonetic_key': phonetic_key,
+    }
+
+
+def build_name_keys(names, pipeline):
+    """Считает name_keys один раз для каждого уникального ФИО"""
+    keys = {}
+    for fio in names:
+        if fio not in keys:
+            keys[fio] = name_keys(fio, pipeline)
+    return keys
 
 
 def create_fio_from_columns(row):
     """Создает ФИО из отдельных колонок"""
     parts = []
-    if pd.notna(row.get('Фамилия')):
+    if not is_missing(row.get('Фамилия')):
         parts.append(str(row['Фамилия']).strip())
-    if pd.notna(row.get('Имя')):
+    if not is_missing(row.get('Имя')):
         parts.append(str(row['Имя']).strip())
-    if pd.notna(row.get('Отчество')):
+    if not is_missing(row.get('Отчество')):
         parts.append(str(row['Отчество']).strip())
     return ' '.join(parts)
 
@@ -107,39 +348,91 @@ def adjust_column_width(ws):
                 cell.alignment = CENTER_ALIGNMENT
 
 
+def format_worksheet(ws):
+    """Применяет к листу ширину колонок, выравнивание и цветовую разметку"""
+    # Настраиваем ширину колонок
+    adjust_column_width(ws)
+
+    # Находим индексы колонок с процентами (по одной на каждый источник)
+    header = [str(cell.value).strip() if cell.value else '' for cell in ws[1]]
+    percent_col_indexes = [idx for idx, col_name in enumerate(header, 1) if 'процент' in str(col_name).lower()]
+
+    # Применяем выравнивание по центру для всех колонок процентов
+    for percent_col_idx in percent_col_indexes:
+        col_letter = get_column_letter(percent_col_idx)
+        for row in range(2, ws.max_row + 1):
+            cell = ws[f"{col_letter}{row}"]
+            cell.alignment = CENTER_ALIGNMENT
+
+    # Применяем цветовую разметку
+    apply_coloring_to_worksheet(ws)
+
+
 def save_with_formatting(filepath, df):
     """Сохраняет DataFrame с форматированием"""
+    wait_for_heavy_modules()
+
     try:
         # Сначала сохраняем без форматирования
         df.to_excel(filepath, index=False)
 
         # Теперь применяем форматирование
         wb = load_workbook(filepath)
-        ws = wb.active
+        format_worksheet(wb.active)
 
-        # Настраиваем ширину колонок
-        adjust_column_width(ws)
+        # Сохраняем изменения
+        wb.save(filepath)
+        print(f"Файл с форматированием сохранен: {filepath}")
+        return True
 
-        # Находим индекс колонки с процентами
-        header = [str(cell.value).strip() if cell.value else '' for cell in ws[1]]
-        percent_col_idx = None
+    except Exception as e:
+        print(f"Ошибка при сохранении с форматированием: {e}")
+        # Пробуем сохранить без форматирования
+        try:
+            df.to_excel(filepath, index=False)
+            print(f"Файл сохранен без форматирования: {filepath}")
+            return True
+        except Exception as e2:
+            print(f"Ошибка при сохранении без форматирования: {e2}")
+            return False
 
-        for idx, col_name in enumerate(header, 1):
-            if 'процент' in str(col_name).lower():
-                percent_col_idx = idx
-                break
 
-        # Применяем выравнивание по центру для всей колонки процентов
-        if percent_col_idx:
-            col_letter = get_column_letter(percent_col_idx)
-            for row in range(2, ws.max_row + 1):
-                cell = ws[f"{col_letter}{row}"]
-                cell.alignment = CENTER_ALIGNMENT
+def stats_sheet_name(sheet_names):
+    """Имя листа статистики, не совпадающее с листами результатов (Excel не различает регистр)"""
+    taken = {name.lower() for name in sheet_names}
+    name = STATS_SHEET_NAME
+    number = 2
+    while name.lower() in taken:
+        name = f"{STATS_SHEET_NAME} {number}"
+        number += 1
+    return name
 
-        # Применяем цветовую разметку
-        apply_coloring_to_worksheet(ws)
 
-        # Сохраняем изменения
+def save_sheets_with_formatting(filepath, sheets, stats_df):
+    """
+    Сохраняет несколько DataFrame в одну книгу с форматированием
+    sheets - словарь {имя листа: DataFrame}, stats_df - сводная статистика
+    (лист STATS_SHEET_NAME, а если такой лист уже есть среди результатов - см. stats_sheet_name)
+    """
+    stats_sheet = stats_sheet_name(sheets)
+    wait_for_heavy_modules()
+
+    def write_sheets():
+        with pd.ExcelWriter(filepath) as writer:
+            for sheet_name, df in sheets.items():
+                df.to_excel(writer, sheet_name=sheet_name, index=False)
+            stats_df.to_excel(writer, sheet_name=stats_sheet, index=False)
+
+    try:
+        # Сначала сохраняем без форматирования
+        write_sheets()
+
+        # Теперь применяем форматирование к листам с результатами
+        wb = load_workbook(filepath)
+        for sheet_name in sheets:
+            format_worksheet(wb[sheet_name])
+        adjust_column_width(wb[stats_sheet])
+
         wb.save(filepath)
         print(f"Файл с форматированием сохранен: {filepath}")
         return True
@@ -148,7 +441,7 @@ def save_with_formatting(filepath, df):
         print(f"Ошибка при сохранении с форматированием: {e}")
         # Пробуем сохранить без форматирования
         try:
-            df.to_excel(filepath, index=False)
+            write_sheets()
             print(f"Файл сохранен без форматирования: {filepath}")
             return True
         except Exception as e2:
@@ -156,21 +449,715 @@ def save_with_formatting(filepath, df):
             return False
 
 
-def process_excel_file(input_file, threshold=85):
+def save_results(input_file, save):
     """
-    Основная функция обработки Excel файла
-    threshold - порог частичного совпадения (85 по умолчанию)
+    Сохраняет результаты рядом с исходным файлом
+    save - функция, принимающая путь к файлу и возвращающая True при успехе
     """
-    # Читаем Excel файл
-    print(f"Чтение файла: {input_file}")
+    # Генерируем имя выходного файла
+    base_name = os.path.splitext(input_file)[0]
+    timestamp = time.strftime("%Y%m%d_%H%M%S")
+    output_file = f"{base_name}_результат_{timestamp}.xlsx"
+
+    # Сохраняем результаты с форматированием
+    print(f"Сохранение результатов в: {output_file}")
+
+    if is_file_locked(output_file) and os.path.exists(output_file):
+        # Если файл существует и заблокирован, создаем новый с другим именем
+        output_file = f"{base_name}_результат_{timestamp}_new.xlsx"
+        print(f"Создаю новый файл: {output_file}")
+
+    success = save(output_file)
+
+    if not success:
+        # Пробуем еще раз с другим именем
+        output_file = f"{base_name}_результат_{timestamp}_final.xlsx"
+        print(f"Пробую сохранить как: {output_file}")
+        success = save(output_file)
+
+        if not success:
+            raise Exception("Не удалось сохранить файл после нескольких попыток")
+
+    return output_file
 
+
+def score_pair(normalized_zup, zup_parts, portal_key, portal_parts):
+    """
+    Оценивает похожесть ФИО из ЗУП и из портала
+    Возвращает оценку или None, если пара не подходит по фамилии/имени/отчеству
+    """
+    wait_for_heavy_modules()
+
+    # Если в ЗУП 3 части (Фамилия Имя Отчество), а в портале 2 части (Фамилия Имя), или наоборот
+    if (len(zup_parts), len(portal_parts)) in ((3, 2), (2, 3)):
+        # Сравниваем фамилии
+        surname_match = fuzz.ratio(zup_parts[0], portal_parts[0])
+        # Сравниваем имена
+        name_match = fuzz.ratio(zup_parts[1], portal_parts[1])
+
+        # Если фамилия и имя хорошо совпадают, это может быть правильным совпадением
+        if surname_match >= 90 and name_match >= 90:
+            # Немного повышаем оценку, так как отчество в одном из источников может отсутствовать
+            adjusted_score = (surname_match + name_match) / 2
+            return min(95, adjusted_score + 5)
+        return None
+
+    # Для случаев, когда количество частей одинаковое
+    if len(zup_parts) == len(portal_parts):
+        # Проверяем каждую часть
+        part_scores = []
+
+        for i in range(len(zup_parts)):
+            part_score = fuzz.ratio(zup_parts[i], portal_parts[i])
+            part_scores.append(part_score)
+
+            # Фамилия и имя должны совпадать хорошо
+            if i in (0, 1) and part_score < 80:
+                return None
+            # Отчество может совпадать хуже, но не слишком плохо
+            elif i == 2 and part_score < 50:
+                return None
+
+        # Рассчитываем средний балл
+        adjusted_score = sum(part_scores) / len(part_scores)
+
+        # Если отчество сильно отличается, снижаем оценку
+        if len(zup_parts) == 3 and part_scores[2] < 70:
+            adjusted_score = adjusted_score * 0.85
+
+        return adjusted_score
+
+    # Общий расчет для остальных случаев
+    return fuzz.token_sort_ratio(normalized_zup, portal_key)
+
+
+def partial_match_status(zup_parts, portal_parts):
+    """Определяет тип частичного совпадения по частям ФИО"""
+    wait_for_heavy_modules()
+
+    if len(zup_parts) == 3 and len(portal_parts) == 3:
+        # Проверяем отчество
+        patronymic_match = fuzz.ratio(zup_parts[2], portal_parts[2])
+        if patronymic_match >= 95:
+            return 'Частичное совпадение'
+        elif patronymic_match >= 70:
+            return 'Частичное совпадение (отчество отличается)'
+        else:
+            return 'Частичное совпадение (разные отчества)'
+    elif len(zup_parts) == 3 and len(portal_parts) == 2:
+        return 'Частичное совпадение (в портале нет отчества)'
+    elif len(zup_parts) == 2 and len(portal_parts) == 3:
+        return 'Частичное совпадение (в ЗУП нет отчества)'
+    return 'Частичное совпадение'
+
+
+def _tagged_bigrams(text):
+    """Биграммы строки с номером повторения, чтобы пересечение множеств считалось с кратностью"""
+    seen = Counter()
+    grams = []
+    for i in range(len(text) - 1):
+        gram = text[i:i + 2]
+        grams.append((gram, seen[gram]))
+        seen[gram] += 1
+    return grams
+
+
+def build_gram_index(strings):
+    """Строит инвертированный индекс биграмм по списку строк"""
+    postings = defaultdict(list)
+    for pos, text in enumerate(strings):
+        for gram in _tagged_bigrams(text):
+            postings[gram].append(pos)
+    return {'strings': strings, 'lengths': [len(text) for text in strings], 'postings': dict(postings)}
+
+
+def gram_lookup(index, text, min_ratio):
+    """
+    Возвращает позиции строк индекса, у которых fuzz.ratio с text не ниже min_ratio (доля от 1)
+
+    Если ratio >= r, то общая подпоследовательность L >= r * (la + lb) / 2 и строки
+    делят не меньше 3L - 1 - la - lb >= (1.5r - 1)(la + lb) - 1 биграмм.
+    Поэтому достаточно перебрать строки, содержащие хотя бы одну из самых редких
+    биграмм запроса (префиксная фильтрация), и проверить их через Levenshtein.ratio.
+    """
+    strings = index['strings']
+    lengths = index['lengths']
+    text_len = len(text)
+
+    if min_ratio <= 0:
+        return range(len(strings))
+
+    # Ограничение по длине: 2 * min(la, lb) / (la + lb) >= r
+    min_len = text_len * min_ratio / (2 - min_ratio) - 1e-9
+    max_len = text_len * (2 - min_ratio) / min_ratio + 1e-9
+    min_shared = math.ceil((1.5 * min_ratio - 1) * (text_len + min_len) - 1 - 1e-9)
+
+    if min_shared <= 0:
+        candidates = range(len(strings))
+    else:
+        postings = index['postings']
+        grams = _tagged_bigrams(text)
+        if min_shared > len(grams):
+            return []
+        grams.sort(key=lambda gram: len(postings.get(gram, ())))
+        candidates = set()
+        for gram in grams[:len(grams) - min_shared + 1]:
+            candidates.update(postings.get(gram, ()))
+
+    # Levenshtein.ratio - та же оценка, что и fuzz.ratio, но без округления
+    min_ratio -= 1e-9
+    return [pos for pos in candidates
+            if min_len <= lengths[pos] <= max_len and Levenshtein.ratio(text, strings[pos]) >= min_ratio]
+
+
+def _token_sort_string(text):
+    """Строка в том виде, в котором ее сравнивает fuzz.token_sort_ratio"""
+    return ' '.join(sorted(fuzz_utils.full_process(text, force_ascii=True).split())).strip()
+
+
+def _uses_token_sort(zup_len, portal_len):
+    """Сравнивается ли пара с таким числом частей ФИО через token_sort_ratio (см. score_pair)"""
+    return zup_len != portal_len and (zup_len, portal_len) not in ((3, 2), (2, 3))
+
+
+def build_word_index(words):
+    """
+    Строит индекс похожих слов (фамилий или имен)
+    words - список слов по позициям ключей портала (None - слова нет)
+    """
+    positions = {}
+    for pos, word in enumerate(words):
+        if word is not None:
+            positions.setdefault(word, []).append(pos)
+
+    word_list = list(positions)
+
+    return {
+        'positions': [positions[word] for word in word_list],
+        'grams': build_gram_index(word_list),
+        'cache': {},
+    }
+
+
+def similar_word_positions(word_index, word):
+    """Возвращает позиции ключей портала, у которых слово совпадает с word по fuzz.ratio не ниже 80"""
+    cache = word_index['cache']
+    if word not in cache:
+        matched = set()
+        for word_pos in gram_lookup(word_index['grams'], word, MIN_WORD_RATIO):
+            matched.update(word_index['positions'][word_pos])
+        cache[word] = matched
+    return cache[word]
+
+
+def build_candidate_index(portal_fios_dict):
+    """
+    Строит индекс кандидатов по ФИО портала, чтобы не сравнивать каждую пару ЗУП-портал
+    Кандидаты ищутся по похожим фамилиям и именам, а для пар с разным числом частей ФИО - по всей строке.
+    Отдельно хранятся ключи портала по exact_key и phonetic_key (см. name_keys)
+    """
+    keys = list(portal_fios_dict)
+    all_parts = [portal_fios_dict[key]['parts'] for key in keys]
+    part_counts = defaultdict(list)
+    exact_keys = defaultdict(list)
+    phonetic_keys = defaultdict(list)
+
+    for pos, key in enumerate(keys):
+        portal_data = portal_fios_dict[key]
+        part_counts[len(portal_data['parts'])].append(pos)
+        exact_keys[portal_data['exact_key']].append(key)
+        if portal_data['phonetic_key']:
+            phonetic_keys[portal_data['phonetic_key']].append(key)
+
+    return {
+        'keys': keys,
+        'exact_keys': dict(exact_keys),
+        'phonetic_keys': dict(phonetic_keys),
+        'part_lengths': [len(parts) for parts in all_parts],
+        'part_counts': dict(part_counts),
+        'surnames': build_word_index([parts[0] for parts in all_parts]),
+        'names': build_word_index([parts[1] if len(parts) > 1 else None for parts in all_parts]),
+        # Индексы строк для token_sort_ratio строятся по мере надобности, отдельно для каждого числа частей ФИО
+        'token_sort_grams': {},
+    }
+
+
+def _token_sort_index(index, count):
+    """Позиции ключей портала с count частями ФИО и индекс биграмм их строк для token_sort_ratio"""
+    if count not in index['token_sort_grams']:
+        count_positions = index['part_counts'][count]
+        index['token_sort_grams'][count] = (
+            count_positions,
+            build_gram_index([_token_sort_string(index['keys'][pos]) for pos in count_positions]),
+        )
+    return index['token_sort_grams'][count]
+
+
+def find_candidates(index, normalized_zup, zup_parts, threshold):
+    """
+    Возвращает ключи портала, которые могут набрать оценку не ниже threshold,
+    в порядке словаря портала (как при полном переборе)
+    """
+    # Все правила score_pair, кроме token_sort_ratio, требуют fuzz.ratio фамилий и имен >= 80
+    positions = similar_word_positions(index['surnames'], zup_parts[0])
+    if len(zup_parts) > 1:
+        positions = positions & similar_word_positions(index['names'], zup_parts[1])
+
+    part_lengths = index['part_lengths']
+    positions = {pos for pos in positions if not _uses_token_sort(len(zup_parts), part_lengths[pos])}
+
+    # Пары с разным числом частей сравниваются по всей строке, но только с ФИО подходящего числа частей
+    token_sort_counts = [count for count in index['part_counts'] if _uses_token_sort(len(zup_parts), count)]
+    if token_sort_counts:
+        token_sort_zup = _token_sort_string(normalized_zup)
+        min_ratio = (threshold - 0.5) / 100
+        for count in token_sort_counts:
+            count_positions, grams = _token_sort_index(index, count)
+            for gram_pos in gram_lookup(grams, token_sort_zup, min_ratio):
+                positions.add(count_positions[gram_pos])
+
+    return [index['keys'][pos] for pos in sorted(positions)]
+
+
+def assign_greedy(zup_entries, portal_fios_dict, candidate_index, threshold, stats=None, scored=None):
+    """
+    Жадное распределение: каждая запись ЗУП по порядку забирает лучшее из оставшихся ФИО портала
+    zup_entries - список (индекс строки, ключи ФИО из name_keys)
+    stats - необязательный Counter, куда записывается число совпадений по этапам и число оцененных пар
+    scored - готовые оценки пар из score_candidates; с ними пары не ищутся и не оцениваются заново
+    Возвращает словарь {индекс строки: (ключ портала, оценка, точное совпадение)}
+    """
+    remaining = set(portal_fios_dict)
+    assignments = {}
+    stats = stats if stats is not None else Counter()
+
+    for pos, (idx, keys) in enumerate(zup_entries):
+        entry = scored[pos] if scored is not None else None
+
+        # Ищем точное совпадение
+        exact_candidates = entry['exact'] if entry else candidate_index['exact_keys'].get(keys['exact_key'], ())
+        exact_key = next((portal_key for portal_key in exact_candidates if portal_key in remaining), None)
+        if exact_key is not None:
+            assignments[idx] = (exact_key, 100, True)
+            remaining.discard(exact_key)
+            stats['exact'] += 1
+            continue
+
+        # Сначала проверяем только ФИО с тем же фонетическим ключом
+        if keys['phonetic_key']:
+            pairs = entry['phonetic'] if entry else _score_remaining(
+                keys, candidate_index['phonetic_keys'].get(keys['phonetic_key'], ()),
+                portal_fios_dict, remaining, stats)
+            best_key, best_score = _best_candidate(pairs, remaining)
+            if best_key and best_score >= threshold:
+                assignments[idx] = (best_key, best_score, False)
+                remaining.discard(best_key)
+                stats['phonetic'] += 1
+                continue
+
+        # Ищем лучшее нечеткое совпадение среди кандидатов
+        pairs = entry['fuzzy'] if entry else _score_remaining(
+            keys, find_candidates(candidate_index, keys['normalized'], keys['parts'], threshold),
+            portal_fios_dict, remaining, stats)
+        best_key, best_score = _best_candidate(pairs, remaining)
+
+        if best_key and best_score >= threshold:
+            assignments[idx] = (best_key, best_score, False)
+            remaining.discard(best_key)
+            stats['fuzzy'] += 1
+
+    return assignments
+
+
+def _score_remaining(keys, candidates, portal_fios_dict, remaining, stats):
+    """Оценивает по score_pair кандидатов из еще не занятых ФИО портала: пары (ключ портала, оценка)"""
+    pairs = []
+    for portal_key in candidates:
+        if portal_key in remaining:
+            pairs.append((portal_key, score_pair(keys['normalized'], keys['parts'],
+                                                 portal_key, portal_fios_dict[portal_key]['parts'])))
+            stats['scored_pairs'] += 1
+    return pairs
+
+
+def _best_candidate(pairs, remaining):
+    """Возвращает лучший из еще не занятых ключ портала и его оценку (при равенстве - первый)"""
+    best_score = 0
+    best_key = None
+
+    for portal_key, score in pairs:
+        if portal_key in remaining and score is not None and score > best_score:
+            best_score = score
+            best_key = portal_key
+
+    return best_key, best_score
+
+
+def score_candidates(zup_entries, portal_fios_dict, candidate_index, min_threshold, stats=None):
+    """
+    Оценивает один раз все пары-кандидаты, которые могут совпасть при любом пороге от min_threshold.
+    По этим оценкам assign_greedy и assign_optimal распределяют совпадения для любого такого порога
+    без повторного поиска (и дают тот же результат)
+    Возвращает список по записям zup_entries: {'exact': [ключи портала с тем же exact_key],
+    'phonetic': [[ключ, оценка]] с тем же фонетическим ключом, 'fuzzy': [[ключ, оценка]] остальных кандидатов}
+    """
+    stats = stats if stats is not None else Counter()
+    scored = []
+
+    for idx, keys in zup_entries:
+        fuzzy = {}
+        for portal_key in find_candidates(candidate_index, keys['normalized'], keys['parts'], min_threshold):
+            score = score_pair(keys['normalized'], keys['parts'], portal_key, portal_fios_dict[portal_key]['parts'])
+            stats['scored_pairs'] += 1
+            # Пары ниже min_threshold не совпадут ни при каком допустимом пороге
+            if score is not None and score > 0 and score >= min_threshold:
+                fuzzy[portal_key] = score
+
+        # Поиск кандидатов без потерь, поэтому похожие по звучанию ФИО выше порога уже оценены
+        phonetic = []
+        if keys['phonetic_key']:
+            phonetic = [[portal_key, fuzzy[portal_key]]
+                        for portal_key in candidate_index['phonetic_keys'].get(keys['phonetic_key'], ())
+                        if portal_key in fuzzy]
+
+        scored.append({
+            'exact': list(candidate_index['exact_keys'].get(keys['exact_key'], ())),
+            'phonetic': phonetic,
+            'fuzzy': [[portal_key, score] for portal_key, score in fuzzy.items()],
+        })
+
+    return scored
+
+
+def _max_weight_matching(edges):
+    """
+    Паросочетание максимального веса в двудольном графе (последовательные кратчайшие пути)
+    edges - список (левая вершина, правая вершина, целый положительный вес)
+    Возвращает словарь {левая вершина: правая вершина}
+    """
+    lefts = list(dict.fromkeys(left for left, _, _ in edges))
+    rights = list(dict.fromkeys(right for _, right, _ in edges))
+    left_ids = {left: i for i, left in enumerate(lefts)}
+    right_ids = {right: len(lefts) + i for i, right in enumerate(rights)}
+    source = len(lefts) + len(rights)
+    sink = source + 1
+
+    # Ребро: [куда, пропускная способность, стоимость, индекс обратного ребра]
+    graph = [[] for _ in range(sink + 1)]
+
+    def add_edge(a, b, cost):
+        graph[a].append([b, 1, cost, len(graph[b])])
+        graph[b].append([a, 0, -cost, len(graph[a]) - 1])
+
+    for i in range(len(lefts)):
+        add_edge(source, i, 0)
+    for left, right, weight in edges:
+        add_edge(left_ids[left], right_ids[right], -weight)
+    for j in right_ids.values():
+        add_edge(j, sink, 0)
+
+    # Начальные потенциалы - кратчайшие расстояния в исходном ациклическом графе
+    potential = [0] * (sink + 1)
+    for left, right, weight in edges:
+        potential[right_ids[right]] = min(potential[right_ids[right]], -weight)
+    potential[sink] = min(potential[right_ids[right]] for right in rights)
+
+    while True:
+        dist = [None] * (sink + 1)
+        prev = [None] * (sink + 1)
+        dist[source] = 0
+        heap = [(0, source)]
+
+        while heap:
+            d, a = heapq.heappop(heap)
+            if d > dist[a]:
+                continue
+            for k, (b, capacity, cost, _) in enumerate(graph[a]):
+                if capacity:
+                    nd = d + cost + potential[a] - potential[b]
+                    if dist[b] is None or nd < dist[b]:
+                        dist[b] = nd
+                        prev[b] = (a, k)
+                        heapq.heappush(heap, (nd, b))
+
+        if dist[sink] is None:
+            break
+
+        for node, d in enumerate(dist):
+            if d is not None:
+                potential[node] += d
+
+        # Потенциал стока равен стоимости пути; неотрицательная стоимость вес уже не увеличит
+        if potential[sink] - potential[source] >= 0:
+            break
+
+        node = sink
+        while node != source:
+            a, k = prev[node]
+            edge = graph[a][k]
+            edge[1] -= 1
+            graph[node][edge[3]][1] += 1
+            node = a
+
+    matching = {}
+    for i, left in enumerate(lefts):
+        for b, capacity, _, _ in graph[i]:
+            if source > b >= len(lefts) and capacity == 0:
+                matching[left] = rights[b - len(lefts)]
+    return matching
+
+
+def assign_optimal(zup_entries, portal_fios_dict, candidate_index, threshold, stats=None, scored=None, quiet=False,
+                   preferred=None):
+    """
+    Оптимальное распределение: паросочетание максимального суммарного процента совпадения
+    по разреженному графу пар выше порога, отдельно для каждой связной компоненты.
+    Точные совпадения входят в граф с весом 100 и уступают только если это дает больший итог
+    stats - необязательный Counter, куда записывается число совпадений по этапам и число оцененных пар
+    scored - готовые оценки пар из score_candidates; с ними пары не ищутся и не оцениваются заново
+    quiet - не печатать размер графа (при повторных распределениях для отчета по порогам)
+    preferred - распределение, которое сохраняется при равном итоге (обычно жадное, см. assign_greedy)
+    Возвращает словарь {индекс строки: (ключ портала, оценка, точное совпадение)}
+    """
+    scores = {}
+    exact_pairs = set()
+    parent = {}
+    stats = stats if stats is not None else Counter()
+
+    def find(node):
+        root = node
+        while parent[root] != root:
+            root = parent[root]
+        while parent[node] != root:
+            parent[node], node = root, parent[node]
+        return root
+
+    def add_edge(idx, portal_key, score):
+        left, right = ('zup', idx), ('portal', portal_key)
+        scores[(idx, portal_key)] = max(score, scores.get((idx, portal_key), 0))
+        parent.setdefault(left, left)
+        parent.setdefault(right, right)
+        parent[find(left)] = find(right)
+
+    if scored is None:
+        scored = score_candidates(zup_entries, portal_fios_dict, candidate_index, threshold, stats)
+
+    # Разреженный граф пар выше порога
+    for (idx, keys), entry in zip(zup_entries, scored):
+        for portal_key in entry['exact']:
+            exact_pairs.add((idx, portal_key))
+            add_edge(idx, portal_key, 100)
+
+        for portal_key, score in entry['fuzzy']:
+            if score >= threshold:
+                add_edge(idx, portal_key, score)
+
+    preferred_pairs = {(idx, assigned[0]) for idx, assigned in (preferred or {}).items()}
+
+    components = defaultdict(list)
+    for (idx, portal_key), score in scores.items():
+        # Вес в сотых долях процента, чтобы считать в целых числах
+        components[find(('zup', idx))].append((idx, portal_key, round(score * 100), (idx, portal_key) in preferred_pairs))
+
+    if not quiet:
+        print(f"Граф кандидатов: {len(scores)} пар, {len(components)} компонент")
+
+    assignments = {}
+
+    for edges in components.values():
+        # При равном итоге выигрывают пары из preferred: бонус за них в сумме меньше разницы в один вес
+        scale = len(edges) + 1
+        edges = [(idx, portal_key, weight * scale + bonus) for idx, portal_key, weight, bonus in edges]
+        for idx, portal_key in _max_weight_matching(edges).items():
+            exact = (idx, portal_key) in exact_pairs
+            assignments[idx] = (portal_key, scores[(idx, portal_key)], exact)
+            stats['exact' if exact else 'fuzzy'] += 1
+
+    return assignments
+
+
+def count_assignment_changes(greedy, optimal):
+    """Считает записи ЗУП, у которых найденное ФИО портала отличается от жадного распределения"""
+    changed = 0
+    for idx in greedy.keys() | optimal.keys():
+        greedy_key = greedy[idx][0] if idx in greedy else None
+        optimal_key = optimal[idx][0] if idx in optimal else None
+        if greedy_key != optimal_key:
+            changed += 1
+    return changed
+
+
+def score_bucket(percent):
+    """Возвращает интервал гистограммы процентов совпадения: '80-89', '90-99', '100'"""
+    if percent >= 100:
+        return '100'
+    low = percent // 10 * 10
+    return f"{low}-{low + 9}"
+
+
+def build_summary(threshold, assignment, records, statuses, score_histogram, assignment_changes, match_stages,
+                  timings):
+    """
+    Собирает сводку по результатам сопоставления
+    records - число записей по источникам, statuses - {источник: {статус: число записей}},
+    score_histogram - {интервал процентов: число совпадений ЗУП},
+    match_stages - {этап: число совпадений} и число оцененных пар (scored_pairs), timings - {этап: секунды}
+    """
+    return {
+        'threshold': threshold,
+        'assignment': assignment,
+        'records': records,
+        'statuses': statuses,
+        'score_histogram': dict(sorted(score_histogram.items(), key=lambda item: int(item[0].split('-')[0]))),
+        'assignment_changes': assignment_changes,
+        'match_stages': match_stages,
+        'timings': timings,
+    }
+
+
+def merge_summaries(summaries):
+    """Объединяет сводки нескольких листов в одну (счетчики и время суммируются)"""
+    summaries = list(summaries)
+    records = Counter()
+    statuses = defaultdict(Counter)
+    score_histogram = Counter()
+    match_stages = Counter()
+    timings = Counter()
+    assignment_changes = None
+
+    for summary in summaries:
+        records.update(summary['records'])
+        for source, counts in summary['statuses'].items():
+            statuses[source].update(counts)
+        score_histogram.update(summary['score_histogram'])
+        match_stages.update(summary['match_stages'])
+        timings.update(summary['timings'])
+        if summary['assignment_changes'] is not None:
+            assignment_changes = (assignment_changes or 0) + summary['assignment_changes']
+
+    merged = build_summary(
+        threshold=summaries[0]['threshold'],
+        assignment=summaries[0]['assignment'],
+        records=dict(records),
+        statuses={source: dict(counts) for source, counts in statuses.items()},
+        score_histogram=dict(score_histogram),
+        assignment_changes=assignment_changes,
+        match_stages=dict(match_stages),
+        timings=dict(timings),
+    )
+
+    # Источники при сверке с несколькими источниками (см. match_sources)
+    sources = list(dict.fromkeys(source for summary in summaries for source in summary.get('sources', ())))
+    if sources:
+        merged['sources'] = sources
+
+    # Отчет по порогам суммируется так же, как статусы
+    threshold_sweep = defaultdict(lambda: defaultdict(Counter))
+    for summary in summaries:
+        for threshold, sweep_statuses in summary.get('threshold_sweep', {}).items():
+            for source, counts in sweep_statuses.items():
+                threshold_sweep[threshold][source].update(counts)
+    if threshold_sweep:
+        merged['threshold_sweep'] = {
+            threshold: {source: dict(counts) for source, counts in sweep_statuses.items()}
+            for threshold, sweep_statuses in threshold_sweep.items()
+        }
+        merged['threshold_sweep_assignment'] = ASSIGNMENT_GREEDY
+
+    return merged
+
+
+def write_summary_json(output_file, summary):
+    """Сохраняет сводку рядом с файлом результатов (<имя файла>_сводка.json)"""
+    summary_file = f"{os.path.splitext(output_file)[0]}_сводка.json"
+    try:
+        with open(summary_file, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"Сводка сохранена: {summary_file}")
+    except OSError as e:
+        print(f"Ошибка при сохранении сводки: {e}")
+        return None
+    return summary_file
+
+
+def write_scores_json(output_file, scores):
+    """Сохраняет оценки пар рядом с файлом результатов (<имя файла>_оценки.json), см. load_scores_json"""
+    scores_file = f"{os.path.splitext(output_file)[0]}_оценки.json"
+    try:
+        with open(scores_file, 'w', encoding='utf-8') as f:
+            json.dump(scores, f, ensure_ascii=False)
+        print(f"Оценки пар сохранены: {scores_file}")
+    except (OSError, TypeError) as e:
+        print(f"Ошибка при сохранении оценок пар: {e}")
+        return None
+    return scores_file
+
+
+def load_scores_json(scores_file):
+    """Читает оценки пар, сохраненные write_scores_json, для пересчета с другим порогом"""
     try:
-        df = pd.read_excel(input_file)
+        with open(scores_file, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        raise ValueError(f"Ошибка при чтении оценок пар: {e}")
+
+
+def flatten_statuses(statuses, prefixed=False):
+    """
+    Собирает статусы сводки в одну строку таблицы
+    prefixed - подписывать статусы источников (кроме ЗУП) их названием, как при сверке с несколькими источниками
+    """
+    row = {}
+    for source, counts in statuses.items():
+        if prefixed and source != 'ЗУП':
+            counts = {f'{source}: {status}': count for status, count in counts.items()}
+        row.update(counts)
+    return row
+
+
+def sweep_match_count(statuses):
+    """Число записей ЗУП, для которых найдено совпадение"""
+    return sum(count for status, count in statuses['ЗУП'].items()
+               if status not in ('Совпадений не найдено', 'Пустое ФИО в ЗУП'))
+
+
+def build_sweep_report(summary):
+    """Таблица отчета по порогам: по строке на порог с числом совпадений и статусами"""
+    rows = []
+    for threshold, statuses in summary['threshold_sweep'].items():
+        row = {'Порог': int(threshold), 'Распределение': summary['threshold_sweep_assignment'],
+               'Совпадений ЗУП': sweep_match_count(statuses)}
+        row.update(flatten_statuses(statuses, 'sources' in summary))
+        rows.append(row)
+
+    report_df = pd.DataFrame(rows)
+    count_columns = [col for col in report_df.columns if col not in ('Порог', 'Распределение')]
+    report_df[count_columns] = report_df[count_columns].fillna(0).astype(int)
+    return report_df
+
+
+def write_sweep_report(output_file, summary):
+    """Сохраняет отчет по порогам рядом с файлом результатов (<имя файла>_подбор_порога.xlsx)"""
+    report_file = f"{os.path.splitext(output_file)[0]}_подбор_порога.xlsx"
+    try:
+        build_sweep_report(summary).to_excel(report_file, index=False)
+        print(f"Отчет по порогам сохранен: {report_file}")
     except Exception as e:
-        raise ValueError(f"Ошибка при чтении файла: {e}")
+        print(f"Ошибка при сохранении отчета по порогам: {e}")
+        return None
+    return report_file
 
+
+def prepare_fio_column(df):
+    """
+    Находит колонки ФИО и добавляет в таблицу служебные колонки
+    _temp_ФИО (полное ФИО) и источник_норм (источник в нижнем регистре)
+    """
     # Проверяем наличие необходимых колонок
     required_columns = ['источник']
+    missing_columns = [col for col in required_columns if col not in df.columns]
+    if missing_columns:
+        raise ValueError(f"Не найдены обязательные колонки: {', '.join(missing_columns)}")
 
     # Проверяем наличие колонок ФИО
     fio_columns_check = []
@@ -204,42 +1191,309 @@ def process_excel_file(input_file, threshold=85):
     # Нормализуем источник
     df['источник_норм'] = df['источник'].astype(str).str.lower().str.strip()
 
-    # Разделяем данные по источникам
-    zups = df[df['источник_норм'].str.contains('зуп', na=False)].copy()
-    portal = df[df['источник_норм'].str.contains('портал', na=False)].copy()
 
-    print(f"Найдено записей в ЗУП: {len(zups)} (основной источник)")
-    print(f"Найдено записей в Портал: {len(portal)} (сравниваем с ЗУП)")
+def build_fio_keys(frames, pipeline):
+    """Считает name_keys один раз для каждого уникального непустого ФИО из всех таблиц frames"""
+    return build_name_keys(
+        (fio for fio in pd.concat([frame['_temp_ФИО'] for frame in frames]) if pd.notna(fio) and str(fio).strip()),
+        pipeline
+    )
 
-    if len(zups) == 0:
-        raise ValueError("Не найдено записей с источником 'ЗУП'")
-    if len(portal) == 0:
-        raise ValueError("Не найдено записей с источником 'портал'")
 
-    # Создаем словарь нормализованных ФИО из ПОРТАЛА
-    portal_fios_dict = {}
-    for idx, row in portal.iterrows():
+def build_source_fios_dict(rows, fio_keys):
+    """
+    Собирает словарь {нормализованное ФИО: данные записи} для источника, с которым сравнивается ЗУП
+    При повторе ФИО остается последняя запись
+    """
+    fios_dict = {}
+    for idx, row in rows.iterrows():
         fio = row['_temp_ФИО']
         if pd.notna(fio) and str(fio).strip():
-            normalized = normalize_name(fio)
-            if normalized:
-                portal_fios_dict[normalized] = {
+            keys = fio_keys[fio]
+            if keys['normalized']:
+                fios_dict[keys['normalized']] = {
                     'original_fio': fio,
                     'row_idx': idx,
-                    'parts': normalized.split()  # Сохраняем разбитые части
+                    'parts': keys['parts'],  # Сохраняем разбитые части
+                    'exact_key': keys['exact_key'],
+                    'phonetic_key': keys['phonetic_key'],
                 }
+    return fios_dict
 
-    print(f"Создан словарь из портала: {len(portal_fios_dict)} уникальных ФИО")
 
-    # Создаем список для результатов
-    results = []
+def build_primary_entries(rows, fio_keys):
+    """Собирает записи основного источника для распределения: список (индекс строки, ключи ФИО)"""
+    entries = []
+    for idx, row in rows.iterrows():
+        fio = row['_temp_ФИО']
+        if pd.notna(fio) and str(fio).strip():
+            entries.append((idx, fio_keys[fio]))
+    return entries
 
-    # Проверяем каждую запись из ЗУП
-    for idx, row in zups.iterrows():
-        zup_fio = row['_temp_ФИО']
-        original_zup_data = row.to_dict()
 
-        if pd.isna(zup_fio) or not str(zup_fio).strip():
+def match_source(zup_entries, source_fios_dict, threshold, assignment=ASSIGNMENT_GREEDY, scored=None,
+                 keep_scores=False):
+    """
+    Строит индекс кандидатов источника и распределяет между ним и записями ЗУП совпадения
+    scored - оценки пар из прошлого запуска (см. score_candidates), с ними индекс не строится
+    keep_scores - заранее оценить пары для всех порогов от SWEEP_THRESHOLDS[0], чтобы потом менять порог без поиска
+    Возвращает распределение (см. assign_greedy), число совпадений по этапам,
+    число назначений, отличающихся от жадного (None для жадного распределения), и оценки пар (или None)
+    """
+    wait_for_heavy_modules()
+
+    candidate_index = None
+    scoring_stats = Counter()
+    if scored is None:
+        candidate_index = build_candidate_index(source_fios_dict)
+        if keep_scores:
+            scored = score_candidates(zup_entries, source_fios_dict, candidate_index,
+                                      min(threshold, SWEEP_THRESHOLDS[0]), scoring_stats)
+
+    match_stages = Counter()
+    assignments = assign_greedy(zup_entries, source_fios_dict, candidate_index, threshold, match_stages, scored)
+    assignment_changes = None
+
+    if assignment == ASSIGNMENT_OPTIMAL:
+        greedy_assignments = assignments
+        match_stages = Counter()
+        assignments = assign_optimal(zup_entries, source_fios_dict, candidate_index, threshold, match_stages, scored,
+                                     preferred=greedy_assignments)
+        assignment_changes = count_assignment_changes(greedy_assignments, assignments)
+        print(f"Оптимальное распределение: найдено {len(assignments)} совпадений "
+              f"(жадное - {len(greedy_assignments)}), отличается назначений: {assignment_changes}")
+
+    match_stages.update(scoring_stats)
+    return assignments, dict(match_stages), assignment_changes, scored
+
+
+def match_status(zup_parts, source_fios_dict, assigned, threshold):
+    """
+    Статус записи ЗУП по назначенному ей ФИО источника
+    assigned - (ключ источника, оценка, точное совпадение) или None
+    Возвращает найденное ФИО источника, процент совпадения и статус
+    """
+    if assigned is None:
+        # При нулевом пороге запись без кандидатов тоже считается частичным совпадением
+        return '', 0, 'Частичное совпадение' if threshold <= 0 else 'Совпадений не найдено'
+
+    source_key, match_score, exact = assigned
+    if exact:
+        status = 'Полное совпадение'
+    else:
+        status = partial_match_status(zup_parts, source_fios_dict[source_key]['parts'])
+    return source_fios_dict[source_key]['original_fio'], int(match_score), status
+
+
+def count_statuses(zup_count, zup_entries, fios_dicts, matches, threshold, combined):
+    """
+    Считает статусы записей по готовым распределениям (как в сводке: {источник: {статус: число записей}})
+    zup_count - число записей ЗУП (с пустыми ФИО), fios_dicts - {источник: словарь ФИО},
+    matches - {источник: распределение}, combined - сверка с несколькими источниками (см. match_sources)
+    """
+    statuses = {'ЗУП': Counter(), **{source: Counter() for source in fios_dicts}}
+
+    empty = zup_count - len(zup_entries)
+    if empty:
+        for source in (statuses if combined else ['ЗУП']):
+            statuses[source]['Пустое ФИО в ЗУП'] += empty
+
+    for idx, keys in zup_entries:
+        source_statuses = []
+        for source, fios_dict in fios_dicts.items():
+            status = match_status(keys['parts'], fios_dict, matches[source].get(idx), threshold)[2]
+            source_statuses.append(status)
+            if combined:
+                statuses[source][status] += 1
+        statuses['ЗУП'][_combined_status(source_statuses) if combined else source_statuses[0]] += 1
+
+    for source, fios_dict in fios_dicts.items():
+        not_found = len(fios_dict) - len({source_key for source_key, _, _ in matches[source].values()})
+        if not_found:
+            statuses[source]['Нет в ЗУП'] += not_found
+
+    return {source: dict(counts) for source, counts in statuses.items()}
+
+
+def threshold_sweep(zup_count, zup_entries, fios_dicts, scored_by_source, combined, thresholds=SWEEP_THRESHOLDS):
+    """
+    Повторяет только распределение и подсчет статусов по готовым оценкам пар для каждого порога
+    Распределение всегда жадное: оптимальное для каждого порога слишком долгое,
+    поэтому при оптимальном распределении отчет - оценка (см. threshold_sweep_assignment в сводке)
+    scored_by_source - {источник: оценки пар из score_candidates}
+    Возвращает {порог: статусы (см. count_statuses)}
+    """
+    sweep = {}
+
+    for threshold in thresholds:
+        matches = {
+            source: assign_greedy(zup_entries, fios_dict, None, threshold, scored=scored_by_source[source])
+            for source, fios_dict in fios_dicts.items()
+        }
+        sweep[str(threshold)] = count_statuses(zup_count, zup_entries, fios_dicts, matches, threshold, combined)
+
+    return sweep
+
+
+def _pipeline_signature(pipeline):
+    """Настройки конвейера в виде, который не меняется при сохранении в JSON"""
+    return {
+        'normalizers': list(pipeline['normalizers']),
+        'order_insensitive': pipeline['order_insensitive'],
+        'phonetic': pipeline['phonetic'],
+    }
+
+
+def saved_scores(scores, source, zup_entries, source_fios_dict, threshold, pipeline):
+    """
+    Возвращает сохраненные оценки пар источника (None, если их еще нет)
+    scores - словарь оценок одного запуска: {'min_threshold', 'pipeline', 'sources': {источник: {'fingerprint', 'pairs'}},
+    'threshold_sweep': отчет по порогам}
+    Проверяет, что оценки посчитаны для тех же данных и настроек и подходят для порога
+    """
+    if not scores:
+        return None
+
+    if source not in scores['sources']:
+        raise ValueError(f"В сохраненных оценках нет источника '{source}'")
+    if threshold < scores['min_threshold']:
+        raise ValueError(f"Сохраненные оценки подходят только для порога от {scores['min_threshold']}")
+    if scores['pipeline'] != _pipeline_signature(pipeline):
+        raise ValueError("Сохраненные оценки посчитаны с другими настройками нормализации")
+
+    source_scores = scores['sources'][source]
+    if source_scores['fingerprint'] != _scores_fingerprint(zup_entries, source_fios_dict):
+        raise ValueError("Сохраненные оценки не соответствуют данным файла")
+
+    return source_scores['pairs']
+
+
+def _scores_fingerprint(zup_entries, source_fios_dict):
+    """
+    Отпечаток данных, по которым считались оценки: строки и ФИО ЗУП по порядку
+    и ФИО источника в порядке словаря (от порядка зависит выбор при равных оценках)
+    """
+    digest = hashlib.sha256()
+    for idx, keys in zup_entries:
+        digest.update(f"{idx}\t{keys['normalized']}\n".encode('utf-8'))
+    digest.update(b'\0')
+    for source_key in source_fios_dict:
+        digest.update(f"{source_key}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def store_scores(scores, source, zup_entries, source_fios_dict, scored, threshold, pipeline):
+    """Сохраняет оценки пар источника в словарь оценок scores (см. saved_scores)"""
+    scores.setdefault('min_threshold', min(threshold, SWEEP_THRESHOLDS[0]))
+    scores.setdefault('pipeline', _pipeline_signature(pipeline))
+    scores.setdefault('sources', {})[source] = {
+        'fingerprint': _scores_fingerprint(zup_entries, source_fios_dict),
+        'pairs': scored,
+    }
+
+
+def build_output_row(df, row_idx, result_columns, row_cache):
+    """
+    Строка итоговой таблицы: источник, колонки результата result_columns и остальные колонки исходной строки row_idx
+    row_cache - словарь {индекс строки: исходные колонки}, чтобы при пересчете не собирать их заново
+    """
+    if row_idx not in row_cache:
+        original_row = df.loc[row_idx]
+        original_columns = {'источник': original_row['источник']}
+        for col in df.columns:
+            col_lower = str(col).lower()
+            if (col_lower in ['источник', 'фамилия', 'имя', 'отчество', '_temp_фио', 'источник_норм'] or
+                    'unnamed' in col_lower):
+                continue
+            original_columns[col] = original_row[col]
+        row_cache[row_idx] = original_columns
+
+    original_columns = row_cache[row_idx]
+    output_row = {'источник': original_columns['источник'], **result_columns}
+
+    # Добавляем остальные колонки
+    for col, value in original_columns.items():
+        if col not in output_row:
+            output_row[col] = value
+    return output_row
+
+
+def match_records(df, threshold=85, assignment=ASSIGNMENT_GREEDY, pipeline=None, scores=None, prepared=None):
+    """
+    Сопоставляет записи ЗУП с записями портала в одной таблице
+    threshold - порог частичного совпадения (85 по умолчанию)
+    assignment - способ распределения совпадений (ASSIGNMENT_GREEDY или ASSIGNMENT_OPTIMAL)
+    pipeline - настройки нормализации и фонетики (DEFAULT_PIPELINE по умолчанию)
+    scores - словарь оценок пар (см. saved_scores): пустой заполняется оценками этого запуска,
+    заполненный используется вместо поиска и оценки пар. С ним в сводку добавляется отчет по порогам
+    prepared - словарь подготовленных данных таблицы: пустой заполняется при подготовке,
+    заполненный используется вместо нее (пересчет той же таблицы с теми же настройками и другим порогом)
+    Возвращает итоговый DataFrame с колонками статуса и совпадения и сводку (см. build_summary)
+    """
+    wait_for_heavy_modules()
+
+    started = time.perf_counter()
+    timings = {}
+    pipeline = pipeline or DEFAULT_PIPELINE
+
+    if not prepared:
+        prepare_fio_column(df)
+
+        # Разделяем данные по источникам
+        zups = df[df['источник_норм'].str.contains('зуп', na=False)].copy()
+        portal = df[df['источник_норм'].str.contains('портал', na=False)].copy()
+
+        print(f"Найдено записей в ЗУП: {len(zups)} (основной источник)")
+        print(f"Найдено записей в Портал: {len(portal)} (сравниваем с ЗУП)")
+
+        if len(zups) == 0:
+            raise ValueError("Не найдено записей с источником 'ЗУП'")
+        if len(portal) == 0:
+            raise ValueError("Не найдено записей с источником 'портал'")
+
+        # Ключи сравнения считаем один раз для каждого уникального ФИО обоих источников
+        fio_keys = build_fio_keys([portal, zups], pipeline)
+
+        # Создаем словарь нормализованных ФИО из ПОРТАЛА
+        portal_fios_dict = build_source_fios_dict(portal, fio_keys)
+
+        print(f"Создан словарь из портала: {len(portal_fios_dict)} уникальных ФИО")
+
+        # Собираем записи ЗУП для распределения
+        zup_entries = build_primary_entries(zups, fio_keys)
+
+        if prepared is not None:
+            prepared.update(df=df, zups=zups, portal=portal, portal_fios_dict=portal_fios_dict,
+                            zup_entries=zup_entries, rows={})
+    else:
+        zups, portal = prepared['zups'], prepared['portal']
+        portal_fios_dict, zup_entries = prepared['portal_fios_dict'], prepared['zup_entries']
+
+    # Исходные колонки строк для итоговой таблицы собираются один раз на таблицу
+    row_cache = prepared['rows'] if prepared is not None else {}
+
+    timings['prepare'] = time.perf_counter() - started
+    stage_started = time.perf_counter()
+
+    scored = saved_scores(scores, 'портал', zup_entries, portal_fios_dict, threshold, pipeline)
+    assignments, match_stages, assignment_changes, scored = match_source(
+        zup_entries, portal_fios_dict, threshold, assignment, scored, keep_scores=scores is not None
+    )
+    if scores is not None and not scores:
+        store_scores(scores, 'портал', zup_entries, portal_fios_dict, scored, threshold, pipeline)
+
+    timings['assignment'] = time.perf_counter() - stage_started
+    stage_started = time.perf_counter()
+
+    # Создаем список для результатов и попутно считаем статистику
+    results = []
+    zup_statuses = Counter()
+    score_histogram = Counter()
+    zup_parts_by_idx = {idx: keys['parts'] for idx, keys in zup_entries}
+
+    for idx, zup_fio in zups['_temp_ФИО'].items():
+        if idx not in zup_parts_by_idx:
+            zup_statuses['Пустое ФИО в ЗУП'] += 1
             results.append({
                 'row_idx': idx,
                 'источник': 'ЗУП',
@@ -250,169 +1504,28 @@ def process_excel_file(input_file, threshold=85):
             })
             continue
 
-        normalized_zup = normalize_name(zup_fio)
-        zup_parts = normalized_zup.split()
-
-        # Ищем точное совпадение
-        exact_match = None
-        if normalized_zup in portal_fios_dict:
-            exact_match = portal_fios_dict[normalized_zup]
-            match_fio = exact_match['original_fio']
-            match_score = 100
-            status = 'Полное совпадение'
-
-            results.append({
-                'row_idx': idx,
-                'источник': 'ЗУП',
-                'фио_в_зуп': zup_fio,
-                'совпадение_с_порталом': match_fio,
-                'процент_совпадения': match_score,
-                'статус_совпадения': status
-            })
-
-            # Удаляем из словаря
-            del portal_fios_dict[normalized_zup]
-            continue
-
-        # Ищем лучшее нечеткое совпадение с УЛУЧШЕННОЙ логикой
-        best_match = ''
-        best_score = 0
-        best_key = None
-
-        for portal_key, portal_data in portal_fios_dict.items():
-            portal_parts = portal_data['parts']
-
-            # Основной расчет - token_sort_ratio для общей похожести
-            score = fuzz.token_sort_ratio(normalized_zup, portal_key)
-
-            # Теперь учитываем случаи, когда в портале нет отчества
-            # Если в ЗУП 3 части (Фамилия Имя Отчество), а в портале 2 части (Фамилия Имя)
-            if len(zup_parts) == 3 and len(portal_parts) == 2:
-                # Сравниваем фамилии
-                surname_match = fuzz.ratio(zup_parts[0], portal_parts[0])
-                # Сравниваем имена
-                name_match = fuzz.ratio(zup_parts[1], portal_parts[1])
-
-                # Если фамилия и имя хорошо совпадают, это может быть правильным совпадением
-                if surname_match >= 90 and name_match >= 90:
-                    # Рассчитываем специальную оценку для этого случая
-                    adjusted_score = (surname_match + name_match) / 2
-                    # Немного повышаем, так как отчество в портале может отсутствовать
-                    adjusted_score = min(95, adjusted_score + 5)
-
-                    if adjusted_score > best_score:
-                        best_score = adjusted_score
-                        best_match = portal_data['original_fio']
-                        best_key = portal_key
-                    continue
-
-            # Если в ЗУП 2 части (Фамилия Имя), а в портале 3 части (Фамилия Имя Отчество)
-            elif len(zup_parts) == 2 and len(portal_parts) == 3:
-                # Сравниваем фамилии
-                surname_match = fuzz.ratio(zup_parts[0], portal_parts[0])
-                # Сравниваем имена
-                name_match = fuzz.ratio(zup_parts[1], portal_parts[1])
-
-                # Если фамилия и имя хорошо совпадают
-                if surname_match >= 90 and name_match >= 90:
-                    # Рассчитываем специальную оценку
-                    adjusted_score = (surname_match + name_match) / 2
-                    adjusted_score = min(95, adjusted_score + 5)
-
-                    if adjusted_score > best_score:
-                        best_score = adjusted_score
-                        best_match = portal_data['original_fio']
-                        best_key = portal_key
-                    continue
-
-            # Для случаев, когда количество частей одинаковое
-            elif len(zup_parts) == len(portal_parts):
-                # Проверяем каждую часть
-                all_good = True
-                part_scores = []
-
-                for i in range(len(zup_parts)):
-                    part_score = fuzz.ratio(zup_parts[i], portal_parts[i])
-                    part_scores.append(part_score)
-
-                    # Фамилия должна совпадать хорошо
-                    if i == 0 and part_score < 80:
-                        all_good = False
-                        break
-                    # Имя должно совпадать хорошо
-                    elif i == 1 and part_score < 80:
-                        all_good = False
-                        break
-                    # Отчество может совпадать хуже, но не слишком плохо
-                    elif i == 2 and part_score < 50:
-                        all_good = False
-                        break
-
-                if all_good:
-                    # Рассчитываем средний балл
-                    adjusted_score = sum(part_scores) / len(part_scores)
-
-                    # Если отчество сильно отличается, снижаем оценку
-                    if len(zup_parts) == 3 and len(portal_parts) == 3:
-                        if part_scores[2] < 70:
-                            adjusted_score = adjusted_score * 0.85
-
-                    if adjusted_score > best_score:
-                        best_score = adjusted_score
-                        best_match = portal_data['original_fio']
-                        best_key = portal_key
-
-            # Общий расчет для остальных случаев
-            else:
-                if score > best_score:
-                    best_score = score
-                    best_match = portal_data['original_fio']
-                    best_key = portal_key
-
-        # Определяем статус совпадения
-        if best_score >= threshold:
-            if best_key:
-                portal_parts = portal_fios_dict[best_key]['parts']
-
-                # Определяем тип совпадения
-                if len(zup_parts) == 3 and len(portal_parts) == 3:
-                    # Проверяем отчество
-                    patronymic_match = fuzz.ratio(zup_parts[2], portal_parts[2]) if len(zup_parts) > 2 and len(
-                        portal_parts) > 2 else 0
-                    if patronymic_match >= 95:
-                        status = 'Частичное совпадение'
-                    elif patronymic_match >= 70:
-                        status = 'Частичное совпадение (отчество отличается)'
-                    else:
-                        status = 'Частичное совпадение (разные отчества)'
-                elif len(zup_parts) == 3 and len(portal_parts) == 2:
-                    status = 'Частичное совпадение (в портале нет отчества)'
-                elif len(zup_parts) == 2 and len(portal_parts) == 3:
-                    status = 'Частичное совпадение (в ЗУП нет отчества)'
-                else:
-                    status = 'Частичное совпадение'
-            else:
-                status = 'Частичное совпадение'
-        else:
-            status = 'Совпадений не найдено'
-            best_match = ''
-            best_score = 0
+        match_fio, percent, status = match_status(zup_parts_by_idx[idx], portal_fios_dict, assignments.get(idx),
+                                                  threshold)
+        zup_statuses[status] += 1
+        if match_fio:
+            score_histogram[score_bucket(percent)] += 1
 
         results.append({
             'row_idx': idx,
             'источник': 'ЗУП',
             'фио_в_зуп': zup_fio,
-            'совпадение_с_порталом': best_match,
-            'процент_совпадения': int(best_score) if best_match else 0,
+            'совпадение_с_порталом': match_fio,
+            'процент_совпадения': percent,
             'статус_совпадения': status
         })
 
-        # Удаляем найденное совпадение из словаря
-        if best_key and best_score >= threshold:
-            del portal_fios_dict[best_key]
-
     # Добавляем записи из портала, которые не нашли совпадений в ЗУП
+    matched_keys = {portal_key for portal_key, _, _ in assignments.values()}
+    portal_statuses = Counter()
     for portal_key, portal_data in portal_fios_dict.items():
+        if portal_key in matched_keys:
+            continue
+        portal_statuses['Нет в ЗУП'] += 1
         results.append({
             'row_idx': portal_data['row_idx'],
             'источник': 'портал',
@@ -432,58 +1545,460 @@ def process_excel_file(input_file, threshold=85):
     # Добавляем оригинальные данные
     output_data = []
 
-    for _, result_row in results_df.iterrows():
-        original_idx = result_row['row_idx']
-        original_row = df.loc[original_idx]
-
-        # Создаем строку для вывода
-        output_row = {
-            'источник': original_row['источник'],
+    for result_row in results_df.to_dict('records'):
+        output_data.append(build_output_row(df, result_row['row_idx'], {
             'статус_совпадения': result_row['статус_совпадения'],
             'совпадение_с_порталом': result_row['совпадение_с_порталом'],
             'процент_совпадения': result_row['процент_совпадения'],
             'фио_в_зуп': result_row['фио_в_зуп']
+        }, row_cache))
+
+    # Создаем итоговый DataFrame
+    final_df = pd.DataFrame(output_data)
+
+    timings['output'] = time.perf_counter() - stage_started
+    timings['total'] = time.perf_counter() - started
+
+    summary = build_summary(
+        threshold=threshold,
+        assignment=assignment,
+        records={'ЗУП': len(zups), 'портал': len(portal), 'портал (уникальных ФИО)': len(portal_fios_dict)},
+        statuses={'ЗУП': dict(zup_statuses), 'портал': dict(portal_statuses)},
+        score_histogram=dict(score_histogram),
+        assignment_changes=assignment_changes,
+        match_stages=match_stages,
+        timings=timings,
+    )
+
+    if scores is not None:
+        stage_started = time.perf_counter()
+        # Отчет зависит только от оценок пар, поэтому считается один раз и хранится вместе с ними
+        if 'threshold_sweep' not in scores:
+            scores['threshold_sweep'] = threshold_sweep(len(zups), zup_entries, {'портал': portal_fios_dict},
+                                                        {'портал': scored}, combined=False)
+        summary['threshold_sweep'] = scores['threshold_sweep']
+        summary['threshold_sweep_assignment'] = ASSIGNMENT_GREEDY
+        timings['threshold_sweep'] = time.perf_counter() - stage_started
+        timings['total'] = time.perf_counter() - started
+
+    return final_df, summary
+
+
+def find_secondary_sources(df, sources=None):
+    """
+    Возвращает словарь {название источника: записи} для сверки с ЗУП
+    sources - названия источников (ищутся по вхождению в колонку 'источник', как 'портал'),
+    None - все источники таблицы, кроме ЗУП. Запись относится к первому подходящему источнику,
+    записи с пустым источником не относятся ни к одному
+    """
+    # Пустые ячейки источника после astype(str) выглядят как 'nan'/'none', поэтому отбираем их по исходной колонке
+    filled = df['источник'].notna() & df['источник'].astype(str).str.strip().ne('')
+    others = df[filled & ~df['источник_норм'].str.contains('зуп', na=False)]
+
+    if sources is None:
+        sources = [source for source in others['источник_норм'].dropna().unique() if source]
+
+    frames = {}
+    for source in sources:
+        mask = others['источник_норм'].str.contains(source.lower(), na=False, regex=False)
+        frames[source] = others[mask].copy()
+        others = others[~mask]
+
+    return frames
+
+
+def _combined_status(statuses):
+    """Общий статус записи ЗУП по статусам совпадения с каждым источником"""
+    if all(status == 'Полное совпадение' for status in statuses):
+        return 'Полное совпадение'
+    if all(status == 'Совпадений не найдено' for status in statuses):
+        return 'Совпадений не найдено'
+    return 'Частичное совпадение'
+
+
+def match_sources(df, sources=None, threshold=85, assignment=ASSIGNMENT_GREEDY, pipeline=None, max_workers=None,
+                  scores=None, prepared=None):
+    """
+    Сверяет ЗУП (основной источник) с несколькими источниками одной таблицы за один проход
+    sources - названия источников для сверки (None - все источники таблицы, кроме ЗУП)
+    max_workers - число процессов для параллельной сверки источников (1 - в текущем процессе)
+    scores - словарь оценок пар всех источников, prepared - подготовленные данные таблицы (см. match_records)
+    Ключи ФИО считаются один раз на всю таблицу, индекс кандидатов - один раз на источник.
+    В итоговой таблице для каждого источника добавляются колонки совпадение_<источник>,
+    процент_<источник> и статус_<источник>, а статус_совпадения - общий статус записи ЗУП
+    Возвращает итоговый DataFrame и сводку (см. build_summary, в ней же список источников 'sources')
+    """
+    wait_for_heavy_modules()
+
+    started = time.perf_counter()
+    timings = {}
+    pipeline = pipeline or DEFAULT_PIPELINE
+
+    if not prepared:
+        prepare_fio_column(df)
+
+        zups = df[df['источник_норм'].str.contains('зуп', na=False)].copy()
+        source_frames = find_secondary_sources(df, sources)
+
+        print(f"Найдено записей в ЗУП: {len(zups)} (основной источник)")
+        for source, rows in source_frames.items():
+            print(f"Найдено записей в источнике '{source}': {len(rows)} (сравниваем с ЗУП)")
+
+        if len(zups) == 0:
+            raise ValueError("Не найдено записей с источником 'ЗУП'")
+        if not source_frames:
+            raise ValueError("Не найдено источников для сверки с ЗУП")
+        empty = [source for source, rows in source_frames.items() if len(rows) == 0]
+        if empty:
+            raise ValueError(f"Не найдено записей с источником: {', '.join(empty)}")
+
+        # Ключи сравнения считаем один раз для каждого уникального ФИО всех источников
+        fio_keys = build_fio_keys([zups, *source_frames.values()], pipeline)
+        zup_entries = build_primary_entries(zups, fio_keys)
+        fios_dicts = {source: build_source_fios_dict(rows, fio_keys) for source, rows in source_frames.items()}
+
+        if prepared is not None:
+            prepared.update(df=df, zups=zups, source_frames=source_frames, fios_dicts=fios_dicts,
+                            zup_entries=zup_entries, rows={})
+    else:
+        zups, source_frames = prepared['zups'], prepared['source_frames']
+        fios_dicts, zup_entries = prepared['fios_dicts'], prepared['zup_entries']
+
+    row_cache = prepared['rows'] if prepared is not None else {}
+    scored_by_source = {
+        source: saved_scores(scores, source, zup_entries, fios_dict, threshold, pipeline)
+        for source, fios_dict in fios_dicts.items()
+    }
+    keep_scores = scores is not None
+
+    timings['prepare'] = time.perf_counter() - started
+    stage_started = time.perf_counter()
+
+    # Каждый источник сверяется с ЗУП независимо, поэтому источники обрабатываются параллельно
+    workers = min(len(fios_dicts), max_workers or os.cpu_count() or 1)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                source: executor.submit(match_source, zup_entries, fios_dict, threshold, assignment,
+                                        scored_by_source[source], keep_scores)
+                for source, fios_dict in fios_dicts.items()
+            }
+            matches = {source: future.result() for source, future in futures.items()}
+    else:
+        matches = {
+            source: match_source(zup_entries, fios_dict, threshold, assignment, scored_by_source[source], keep_scores)
+            for source, fios_dict in fios_dicts.items()
         }
 
-        # Добавляем остальные колонки
-        for col in df.columns:
-            col_lower = str(col).lower()
-            if (col_lower in ['источник', 'фамилия', 'имя', 'отчество', '_temp_фио', 'источник_норм'] or
-                    'unnamed' in col_lower):
+    if scores is not None and not scores:
+        for source in fios_dicts:
+            store_scores(scores, source, zup_entries, fios_dicts[source], matches[source][3], threshold, pipeline)
+
+    timings['assignment'] = time.perf_counter() - stage_started
+    stage_started = time.perf_counter()
+
+    # Собираем результаты по записям ЗУП и попутно считаем статистику
+    results = []
+    statuses = {'ЗУП': Counter(), **{source: Counter() for source in fios_dicts}}
+    score_histogram = Counter()
+    zup_parts_by_idx = {idx: keys['parts'] for idx, keys in zup_entries}
+
+    for idx, zup_fio in zups['_temp_ФИО'].items():
+        result = {'row_idx': idx, 'фио_в_зуп': zup_fio if pd.notna(zup_fio) else ''}
+
+        if idx not in zup_parts_by_idx:
+            result['статус_совпадения'] = 'Пустое ФИО в ЗУП'
+            for source in fios_dicts:
+                result.update({f'совпадение_{source}': '', f'процент_{source}': 0,
+                               f'статус_{source}': 'Пустое ФИО в ЗУП'})
+                statuses[source]['Пустое ФИО в ЗУП'] += 1
+            statuses['ЗУП']['Пустое ФИО в ЗУП'] += 1
+            results.append(result)
+            continue
+
+        source_statuses = []
+        for source, fios_dict in fios_dicts.items():
+            match_fio, percent, status = match_status(zup_parts_by_idx[idx], fios_dict, matches[source][0].get(idx),
+                                                      threshold)
+            if match_fio:
+                score_histogram[score_bucket(percent)] += 1
+
+            statuses[source][status] += 1
+            source_statuses.append(status)
+            result.update({f'совпадение_{source}': match_fio, f'процент_{source}': percent,
+                           f'статус_{source}': status})
+
+        result['статус_совпадения'] = _combined_status(source_statuses)
+        statuses['ЗУП'][result['статус_совпадения']] += 1
+        results.append(result)
+
+    # Добавляем записи источников, которые не нашли совпадений в ЗУП
+    for source, fios_dict in fios_dicts.items():
+        matched_keys = {source_key for source_key, _, _ in matches[source][0].values()}
+        for source_key, source_data in fios_dict.items():
+            if source_key in matched_keys:
                 continue
-            if col not in output_row:
-                output_row[col] = original_row[col]
+            statuses[source]['Нет в ЗУП'] += 1
+            results.append({
+                'row_idx': source_data['row_idx'],
+                'фио_в_зуп': '',
+                'статус_совпадения': 'Нет в ЗУП',
+                f'совпадение_{source}': source_data['original_fio'],
+                f'процент_{source}': 0,
+                f'статус_{source}': 'Нет в ЗУП',
+            })
 
-        output_data.append(output_row)
+    # Добавляем оригинальные данные (порядок строк: ЗУП, затем источники по порядку)
+    source_columns = [f'{prefix}_{source}' for source in fios_dicts for prefix in ('совпадение', 'процент', 'статус')]
+    output_data = []
+
+    for result in results:
+        result_columns = {'статус_совпадения': result['статус_совпадения'], 'фио_в_зуп': result['фио_в_зуп']}
+        for column in source_columns:
+            result_columns[column] = result.get(column, '')
+        output_data.append(build_output_row(df, result['row_idx'], result_columns, row_cache))
 
-    # Создаем итоговый DataFrame
     final_df = pd.DataFrame(output_data)
 
-    # Генерируем имя выходного файла
-    base_name = os.path.splitext(input_file)[0]
-    timestamp = time.strftime("%Y%m%d_%H%M%S")
-    output_file = f"{base_name}_результат_{timestamp}.xlsx"
+    timings['output'] = time.perf_counter() - stage_started
+    timings['total'] = time.perf_counter() - started
+
+    records = {'ЗУП': len(zups)}
+    for source, rows in source_frames.items():
+        records[source] = len(rows)
+        records[f'{source} (уникальных ФИО)'] = len(fios_dicts[source])
+
+    match_stages = Counter()
+    assignment_changes = None
+    for _, stages, changes, _ in matches.values():
+        match_stages.update(stages)
+        if changes is not None:
+            assignment_changes = (assignment_changes or 0) + changes
+
+    summary = build_summary(
+        threshold=threshold,
+        assignment=assignment,
+        records=records,
+        statuses={source: dict(counts) for source, counts in statuses.items()},
+        score_histogram=dict(score_histogram),
+        assignment_changes=assignment_changes,
+        match_stages=dict(match_stages),
+        timings=timings,
+    )
+    summary['sources'] = list(fios_dicts)
+
+    if scores is not None:
+        stage_started = time.perf_counter()
+        # Отчет зависит только от оценок пар, поэтому считается один раз и хранится вместе с ними
+        if 'threshold_sweep' not in scores:
+            scores['threshold_sweep'] = threshold_sweep(
+                len(zups), zup_entries, fios_dicts, {source: match[3] for source, match in matches.items()},
+                combined=True
+            )
+        summary['threshold_sweep'] = scores['threshold_sweep']
+        summary['threshold_sweep_assignment'] = ASSIGNMENT_GREEDY
+        timings['threshold_sweep'] = time.perf_counter() - stage_started
+        timings['total'] = time.perf_counter() - started
+
+    return final_df, summary
+
+
+def match_table(df, threshold=85, assignment=ASSIGNMENT_GREEDY, pipeline=None, sources=None, max_workers=None,
+                scores=None, prepared=None):
+    """
+    Сопоставляет записи таблицы: ЗУП с порталом (sources=None, см. match_records)
+    или ЗУП с несколькими источниками (см. match_sources, пустой список - все источники таблицы)
+    """
+    if sources is None:
+        return match_records(df, threshold, assignment, pipeline, scores, prepared)
+    return match_sources(df, sources or None, threshold, assignment, pipeline, max_workers, scores, prepared)
 
-    # Сохраняем результаты с форматированием
-    print(f"Сохранение результатов в: {output_file}")
 
-    if is_file_locked(output_file) and os.path.exists(output_file):
-        # Если файл существует и заблокирован, создаем новый с другим именем
-        output_file = f"{base_name}_результат_{timestamp}_new.xlsx"
-        print(f"Создаю новый файл: {output_file}")
+def read_sheet(input_file, sheet_name=0):
+    """Читает один лист Excel файла"""
+    wait_for_heavy_modules()
 
-    success = save_with_formatting(output_file, final_df)
+    try:
+        return pd.read_excel(input_file, sheet_name=sheet_name)
+    except Exception as e:
+        raise ValueError(f"Ошибка при чтении файла: {e}")
 
-    if not success:
-        # Пробуем еще раз с другим именем
-        output_file = f"{base_name}_результат_{timestamp}_final.xlsx"
-        print(f"Пробую сохранить как: {output_file}")
-        success = save_with_formatting(output_file, final_df)
 
-        if not success:
-            raise Exception("Не удалось сохранить файл после нескольких попыток")
+def process_excel_file(input_file, threshold=85, assignment=ASSIGNMENT_GREEDY, pipeline=None, sources=None,
+                       scores=None, prepared=None):
+    """
+    Основная функция обработки Excel файла (первый лист)
+    threshold - порог частичного совпадения (85 по умолчанию)
+    assignment - способ распределения совпадений (ASSIGNMENT_GREEDY или ASSIGNMENT_OPTIMAL)
+    pipeline - настройки нормализации и фонетики (DEFAULT_PIPELINE по умолчанию)
+    sources - источники для сверки с ЗУП (None - только портал, пустой список - все источники таблицы)
+    scores - словарь оценок пар (см. match_records), например из load_scores_json
+    prepared - подготовленные данные таблицы (см. match_records); с заполненным файл не читается заново
+    Возвращает путь к файлу, итоговый DataFrame и сводку (сохраняется рядом с файлом в JSON).
+    С оценками пар рядом сохраняются также сами оценки и отчет по порогам
+    """
+    timings = {}
+    if prepared:
+        df = prepared['df']
+    else:
+        # Читаем Excel файл
+        print(f"Чтение файла: {input_file}")
+        read_started = time.perf_counter()
+        df = read_sheet(input_file)
+        timings['read'] = time.perf_counter() - read_started
+
+    final_df, summary = match_table(df, threshold, assignment, pipeline, sources, scores=scores, prepared=prepared)
+    summary['timings'].update(timings)
+
+    save_started = time.perf_counter()
+    output_file = save_results(input_file, lambda path: save_with_formatting(path, final_df))
+    summary['timings']['save'] = time.perf_counter() - save_started
+
+    write_summary_json(output_file, summary)
+    if scores:
+        write_scores_json(output_file, scores)
+        write_sweep_report(output_file, summary)
+
+    return output_file, final_df, summary
+
+
+def list_sheet_names(input_file):
+    """Возвращает список листов Excel файла"""
+    wait_for_heavy_modules()
+
+    try:
+        with pd.ExcelFile(input_file) as excel_file:
+            return list(excel_file.sheet_names)
+    except Exception as e:
+        raise ValueError(f"Ошибка при чтении файла: {e}")
 
-    return output_file, final_df
+
+def _process_sheet(input_file, sheet_name, threshold, assignment, pipeline=None, sources=None, scores=None,
+                   prepared=None):
+    """
+    Читает и сопоставляет один лист (выполняется в отдельном процессе)
+    Оценки пар scores и подготовленные данные prepared возвращаются вместе с результатом,
+    так как процесс работает со своими копиями
+    """
+    timings = {}
+    if prepared:
+        df = prepared['df']
+    else:
+        print(f"Чтение листа '{sheet_name}' из файла: {input_file}")
+        read_started = time.perf_counter()
+        df = read_sheet(input_file, sheet_name)
+        timings['read'] = time.perf_counter() - read_started
+
+    # Листы уже обрабатываются в отдельных процессах, поэтому источники сверяются последовательно
+    final_df, summary = match_table(df, threshold, assignment, pipeline, sources, max_workers=1, scores=scores,
+                                    prepared=prepared)
+    summary['timings'].update(timings)
+    return final_df, summary, scores, prepared
+
+
+def build_sheets_statistics(summaries, errors):
+    """
+    Собирает сводную статистику по листам из готовых сводок
+    summaries - {имя листа: сводка}, errors - {имя листа: текст ошибки}
+    """
+    rows = []
+    for sheet_name, summary in summaries.items():
+        row = {
+            'Лист': sheet_name,
+            'Записей ЗУП': summary['records']['ЗУП'],
+        }
+        row.update(flatten_statuses(summary['statuses'], 'sources' in summary))
+        rows.append(row)
+
+    for sheet_name, error in errors.items():
+        rows.append({'Лист': sheet_name, 'Ошибка': error})
+
+    stats_df = pd.DataFrame(rows)
+    count_columns = [col for col in stats_df.columns if col not in ('Лист', 'Ошибка')]
+    stats_df[count_columns] = stats_df[count_columns].fillna(0).astype(int)
+
+    # Итоговая строка по всем листам
+    total_row = {'Лист': 'Итого'}
+    total_row.update({col: int(stats_df[col].sum()) for col in count_columns})
+    stats_df = pd.concat([stats_df, pd.DataFrame([total_row])], ignore_index=True)
+
+    return stats_df
+
+
+def process_excel_sheets(input_file, threshold=85, sheet_names=None, max_workers=None,
+                         assignment=ASSIGNMENT_GREEDY, pipeline=None, sources=None, scores=None, prepared=None):
+    """
+    Обрабатывает несколько листов Excel файла параллельно
+    sheet_names - список листов (None - все листы книги)
+    max_workers - число процессов (по умолчанию по числу ядер)
+    assignment - способ распределения совпадений (ASSIGNMENT_GREEDY или ASSIGNMENT_OPTIMAL)
+    pipeline - настройки нормализации и фонетики (DEFAULT_PIPELINE по умолчанию)
+    sources - источники для сверки с ЗУП (None - только портал, пустой список - все источники таблицы)
+    scores - словарь {имя листа: оценки пар} (см. match_records), заполняется оценками новых листов
+    prepared - словарь {имя листа: подготовленные данные} (см. match_records), заполняется так же
+    Результаты каждого листа сохраняются на одноименный лист выходного файла,
+    сводная статистика - на лист STATS_SHEET_NAME (или с номером, если такое имя занято листом книги)
+    Возвращает путь к файлу, словарь {имя листа: итоговый DataFrame} и общую сводку
+    (в ней же сводки по листам 'sheets' и ошибки 'errors')
+    """
+    available = list_sheet_names(input_file)
+
+    if sheet_names is None:
+        sheet_names = available
+    else:
+        missing = [name for name in sheet_names if name not in available]
+        if missing:
+            raise ValueError(f"В файле нет листов: {', '.join(missing)}")
+
+    if not sheet_names:
+        raise ValueError("Не выбрано ни одного листа для обработки")
+
+    print(f"Листов к обработке: {len(sheet_names)} ({', '.join(sheet_names)})")
+
+    results = {}
+    summaries = {}
+    errors = {}
+
+    workers = min(len(sheet_names), max_workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            sheet_name: executor.submit(_process_sheet, input_file, sheet_name, threshold, assignment, pipeline,
+                                        sources, None if scores is None else scores.get(sheet_name, {}),
+                                        None if prepared is None else prepared.get(sheet_name, {}))
+            for sheet_name in sheet_names
+        }
+        for sheet_name, future in futures.items():
+            try:
+                results[sheet_name], summaries[sheet_name], sheet_scores, sheet_prepared = future.result()
+                if scores is not None:
+                    scores[sheet_name] = sheet_scores
+                if prepared is not None:
+                    prepared[sheet_name] = sheet_prepared
+                print(f"Лист '{sheet_name}' обработан")
+            except ValueError as e:
+                errors[sheet_name] = str(e)
+                print(f"Лист '{sheet_name}' пропущен: {e}")
+
+    if not results:
+        raise ValueError("Не удалось обработать ни один лист:\n" +
+                         '\n'.join(f"{name}: {error}" for name, error in errors.items()))
+
+    stats_df = build_sheets_statistics(summaries, errors)
+
+    summary = merge_summaries(summaries.values())
+    summary['sheets'] = summaries
+    summary['errors'] = errors
+
+    save_started = time.perf_counter()
+    output_file = save_results(input_file, lambda path: save_sheets_with_formatting(path, results, stats_df))
+    summary['timings']['save'] = time.perf_counter() - save_started
+
+    write_summary_json(output_file, summary)
+    if scores:
+        write_scores_json(output_file, scores)
+        write_sweep_report(output_file, summary)
+
+    return output_file, results, summary
 
 
 def apply_coloring_to_worksheet(ws):
@@ -507,8 +2022,10 @@ def apply_coloring_to_worksheet(ws):
         for idx, col_name in enumerate(header, 1):
             col_name_str = str(col_name).lower()
             if 'статус' in col_name_str:
-                status_col_idx = idx
-                print(f"Найдена колонка статуса: {col_name} (индекс {idx})")
+                # Берем первую колонку статуса (общий статус, если источников несколько)
+                if status_col_idx is None:
+                    status_col_idx = idx
+                    print(f"Найдена колонка статуса: {col_name} (индекс {idx})")
             elif 'источник' in col_name_str:
                 source_col_idx = idx
                 print(f"Найдена колонка источника: {col_name} (индекс {idx})")
@@ -604,23 +2121,47 @@ def select_file():
     return file_path
 
 
-def create_settings_window():
-    """Создает окно настроек для выбора порога совпадения"""
+def parse_name_list(text):
+    """Разбирает список имен (листов, источников), введенный через запятую (пустая строка - None)"""
+    names = [name.strip() for name in text.split(',') if name.strip()]
+    return names or None
+
+
+def create_settings_window(startup_time=None):
+    """
+    Создает окно настроек для выбора порога совпадения и листов книги
+    startup_time - момент запуска программы (time.perf_counter) для замера холодного старта
+    Возвращает словарь настроек: threshold, assignment, pipeline, sources, threshold_sweep, multi_sheet, sheet_names
+    """
 
     def on_submit():
         try:
             threshold = int(threshold_var.get())
             if 0 <= threshold <= 100:
-                window.threshold = threshold
+                window.settings['threshold'] = threshold
+                window.settings['assignment'] = ASSIGNMENT_OPTIMAL if optimal_var.get() else ASSIGNMENT_GREEDY
+                if phonetic_var.get():
+                    window.settings['pipeline'] = dict(DEFAULT_PIPELINE, phonetic='ru_metaphone')
+                if multi_source_var.get():
+                    window.settings['sources'] = parse_name_list(sources_var.get()) or []
+                window.settings['threshold_sweep'] = sweep_var.get()
+                window.settings['multi_sheet'] = multi_sheet_var.get()
+                window.settings['sheet_names'] = parse_name_list(sheets_var.get())
                 window.destroy()
             else:
                 messagebox.showerror("Ошибка", "Порог должен быть от 0 до 100")
         except ValueError:
             messagebox.showerror("Ошибка", "Введите число от 0 до 100")
 
+    def on_multi_source_toggle():
+        sources_entry.config(state=tk.NORMAL if multi_source_var.get() else tk.DISABLED)
+
+    def on_multi_sheet_toggle():
+        sheets_entry.config(state=tk.NORMAL if multi_sheet_var.get() else tk.DISABLED)
+
     window = tk.Tk()
     window.title("Настройки обработки")
-    window.geometry("400x200")
+    window.geometry("400x490")
 
     # Центрируем окно
     window.update_idletasks()
@@ -637,19 +2178,64 @@ def create_settings_window():
     entry = tk.Entry(window, textvariable=threshold_var, font=("Arial", 12), width=10)
     entry.pack(pady=10)
 
-    tk.Button(window, text="Начать обработку", command=on_submit, width=15, height=2).pack(pady=20)
+    # Оптимальное распределение совпадений
+    optimal_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(window, text="Оптимальное распределение совпадений",
+                   variable=optimal_var).pack()
+
+    # Подбор порога: оценки пар считаются один раз, порог можно менять без повторного поиска
+    sweep_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(window, text=f"Подбор порога (отчет {SWEEP_THRESHOLDS[0]}-{SWEEP_THRESHOLDS[-1]}, быстрый пересчет)",
+                   variable=sweep_var).pack()
+
+    # Фонетическое сравнение фамилий и имен
+    phonetic_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(window, text="Учитывать похожие по звучанию ФИО",
+                   variable=phonetic_var).pack()
+
+    # Сверка ЗУП с несколькими источниками
+    multi_source_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(window, text="Сверить ЗУП с несколькими источниками",
+                   variable=multi_source_var, command=on_multi_source_toggle).pack()
+    tk.Label(window, text="Источники через запятую (пусто - все, кроме ЗУП)").pack()
+
+    sources_var = tk.StringVar(value="")
+    sources_entry = tk.Entry(window, textvariable=sources_var, width=40, state=tk.DISABLED)
+    sources_entry.pack(pady=5)
+
+    # Обработка нескольких листов книги
+    multi_sheet_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(window, text="Обработать несколько листов книги",
+                   variable=multi_sheet_var, command=on_multi_sheet_toggle).pack()
+    tk.Label(window, text="Листы через запятую (пусто - все листы)").pack()
+
+    sheets_var = tk.StringVar(value="")
+    sheets_entry = tk.Entry(window, textvariable=sheets_var, width=40, state=tk.DISABLED)
+    sheets_entry.pack(pady=5)
+
+    tk.Button(window, text="Начать обработку", command=on_submit, width=15, height=2).pack(pady=15)
+
+    window.settings = {'threshold': 85, 'assignment': ASSIGNMENT_GREEDY, 'pipeline': DEFAULT_PIPELINE,
+                       'sources': None, 'threshold_sweep': False, 'multi_sheet': False, 'sheet_names': None}
+
+    if startup_time is not None:
+        window.after_idle(lambda: print(
+            f"Окно настроек показано через {time.perf_counter() - startup_time:.2f} с после запуска"))
 
-    window.threshold = 85
     window.mainloop()
 
-    return getattr(window, 'threshold', 85)
+    return window.settings
 
 
-def show_results_window(output_file, df):
-    """Показывает окно с результатами обработки"""
+def show_results_window(output_file, summary):
+    """
+    Показывает окно с результатами обработки
+    summary - сводка, собранная при сопоставлении (см. build_summary)
+    Возвращает новый порог, если пользователь попросил пересчитать результаты (только с отчетом по порогам)
+    """
     root = tk.Tk()
     root.title("Результаты обработки")
-    root.geometry("620x720")
+    root.geometry("620x820")
 
     # Центрируем окно
     root.update_idletasks()
@@ -695,43 +2281,79 @@ def show_results_window(output_file, df):
     stats_frame = tk.LabelFrame(main_frame, text="Статистика для ЗУП", padx=10, pady=10)
     stats_frame.pack(fill=tk.X, pady=5)
 
-    if 'статус_совпадения' in df.columns:
-        zup_data = df[df['источник'].astype(str).str.lower().str.contains('зуп', na=False)]
-
-        if len(zup_data) > 0:
-            stats = zup_data['статус_совпадения'].value_counts()
-
-            for result, count in stats.items():
-                frame = tk.Frame(stats_frame)
-                frame.pack(fill=tk.X, pady=2)
-
-                # Цветной индикатор
-                if result == 'Полное совпадение':
-                    color = 'green'
-                elif result == 'Частичное совпадение':
-                    color = 'orange'
-                elif result == 'Совпадений не найдено':
-                    color = 'red'
-                elif result == 'Пустое ФИО в ЗУП':
-                    color = 'gray'
-                else:
-                    color = 'black'
+    zup_statuses = summary['statuses'].get('ЗУП', {})
+    for result, count in sorted(zup_statuses.items(), key=lambda item: item[1], reverse=True):
+        frame = tk.Frame(stats_frame)
+        frame.pack(fill=tk.X, pady=2)
 
-                tk.Label(frame, text="●", fg=color, font=("Arial", 12)).pack(side=tk.LEFT, padx=5)
-                tk.Label(frame, text=f"{result}: {count} записей",
-                         font=("Arial", 10)).pack(side=tk.LEFT)
+        # Цветной индикатор
+        if result == 'Полное совпадение':
+            color = 'green'
+        elif result == 'Частичное совпадение':
+            color = 'orange'
+        elif result == 'Совпадений не найдено':
+            color = 'red'
+        elif result == 'Пустое ФИО в ЗУП':
+            color = 'gray'
+        else:
+            color = 'black'
 
-    # Статистика по порталу
-    if 'статус_совпадения' in df.columns:
-        portal_data = df[df['источник'].astype(str).str.lower().str.contains('портал', na=False)]
-        if len(portal_data) > 0:
-            portal_not_found = portal_data[portal_data['статус_совпадения'] == 'Нет в ЗУП']
-            if len(portal_not_found) > 0:
-                portal_frame = tk.LabelFrame(main_frame, text="Записи портала без совпадений", padx=10, pady=10)
-                portal_frame.pack(fill=tk.X, pady=5)
+        tk.Label(frame, text="●", fg=color, font=("Arial", 12)).pack(side=tk.LEFT, padx=5)
+        tk.Label(frame, text=f"{result}: {count} записей",
+                 font=("Arial", 10)).pack(side=tk.LEFT)
 
-                tk.Label(portal_frame, text=f"Записей портала без совпадений в ЗУП: {len(portal_not_found)}",
-                         font=("Arial", 10)).pack()
+    # Статистика по порталу и другим источникам
+    for source, counts in summary['statuses'].items():
+        not_found = counts.get('Нет в ЗУП', 0)
+        if source == 'ЗУП' or not_found == 0:
+            continue
+        portal_frame = tk.LabelFrame(main_frame, text=f"Записи источника '{source}' без совпадений",
+                                     padx=10, pady=10)
+        portal_frame.pack(fill=tk.X, pady=5)
+
+        tk.Label(portal_frame, text=f"Записей без совпадений в ЗУП: {not_found}",
+                 font=("Arial", 10)).pack()
+
+    # Сравнение оптимального распределения с жадным
+    if summary['assignment_changes'] is not None:
+        assignment_frame = tk.LabelFrame(main_frame, text="Оптимальное распределение", padx=10, pady=10)
+        assignment_frame.pack(fill=tk.X, pady=5)
+
+        tk.Label(assignment_frame, text=f"Назначений, отличающихся от жадного: {summary['assignment_changes']}",
+                 font=("Arial", 10)).pack()
+
+    # Отчет по порогам и пересчет с другим порогом по сохраненным оценкам пар
+    root.new_threshold = None
+    if 'threshold_sweep' in summary:
+        sweep_frame = tk.LabelFrame(main_frame, text="Подбор порога", padx=10, pady=10)
+        sweep_frame.pack(fill=tk.X, pady=5)
+
+        counts = ', '.join(f"{threshold}% - {sweep_match_count(summary['threshold_sweep'][str(threshold)])}"
+                           for threshold in SWEEP_THRESHOLDS[::10])
+        sweep_label = "Совпадений ЗУП при пороге"
+        if summary['threshold_sweep_assignment'] != summary['assignment']:
+            sweep_label += " (оценка по жадному распределению)"
+        tk.Label(sweep_frame, text=f"{sweep_label}: {counts}",
+                 wraplength=550, justify=tk.LEFT, font=("Arial", 10)).pack()
+
+        def on_rethreshold():
+            try:
+                threshold = int(threshold_var.get())
+            except ValueError:
+                messagebox.showerror("Ошибка", "Введите число от 0 до 100")
+                return
+            if not SWEEP_THRESHOLDS[0] <= threshold <= 100:
+                messagebox.showerror("Ошибка", f"Порог должен быть от {SWEEP_THRESHOLDS[0]} до 100")
+                return
+            root.new_threshold = threshold
+            root.destroy()
+
+        rethreshold_frame = tk.Frame(sweep_frame)
+        rethreshold_frame.pack(pady=5)
+        threshold_var = tk.StringVar(value=str(summary['threshold']))
+        tk.Entry(rethreshold_frame, textvariable=threshold_var, width=10).pack(side=tk.LEFT, padx=5)
+        tk.Button(rethreshold_frame, text="Пересчитать с этим порогом",
+                  command=on_rethreshold).pack(side=tk.LEFT)
 
     # Инструкция по цветам
     instr_frame = tk.LabelFrame(main_frame, text="Инструкция по цветам", padx=10, pady=10)
@@ -768,6 +2390,8 @@ def show_results_window(output_file, df):
 
     root.mainloop()
 
+    return root.new_threshold
+
 
 def main():
     print("=" * 50)
@@ -775,9 +2399,16 @@ def main():
     print("Раскрашиваются только записи ЗУП")
     print("=" * 50)
 
+    # Холодный старт считается от первой строки модуля, вместе с импортами
+    startup_time = PROGRAM_START
+
+    # Пока пользователь выбирает порог и файл, модули грузятся в фоне
+    start_background_loading()
+
     try:
         # Показываем окно настроек
-        threshold = create_settings_window()
+        settings = create_settings_window(startup_time)
+        threshold = settings['threshold']
         print(f"Установлен порог совпадения: {threshold}%")
 
         # Выбираем файл
@@ -789,11 +2420,30 @@ def main():
 
         print(f"Выбран файл: {input_file}")
 
-        # Запуск обработки
-        output_file, df = process_excel_file(input_file, threshold)
+        wait_for_heavy_modules()
+        print(format_import_report())
+
+        # Оценки пар и подготовленные данные первого запуска используются при пересчете с другим порогом
+        scores = {} if settings['threshold_sweep'] else None
+        prepared = {} if settings['threshold_sweep'] else None
+
+        while threshold is not None:
+            # Запуск обработки
+            if settings['multi_sheet']:
+                output_file, _, summary = process_excel_sheets(input_file, threshold, settings['sheet_names'],
+                                                               assignment=settings['assignment'],
+                                                               pipeline=settings['pipeline'],
+                                                               sources=settings['sources'], scores=scores,
+                                                               prepared=prepared)
+            else:
+                output_file, _, summary = process_excel_file(input_file, threshold, settings['assignment'],
+                                                             settings['pipeline'], settings['sources'], scores,
+                                                             prepared)
 
-        # Показываем результаты в графическом окне
-        show_results_window(output_file, df)
+            # Показываем результаты в графическом окне
+            threshold = show_results_window(output_file, summary)
+            if threshold is not None:
+                print(f"Пересчет с порогом совпадения: {threshold}%")
 
     except ValueError as e:
         messagebox.showerror("Ошибка", str(e))
@@ -806,4 +2456,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # Нужно для дочерних процессов в собранном exe
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
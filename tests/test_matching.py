@@ -0,0 +1,293 @@
+"""
+Проверки инвариантов движка сопоставления на случайных данных:
+- индекс кандидатов (gram_lookup, find_candidates) не теряет ни одной пары выше порога;
+- жадное распределение по индексу совпадает с исходным полным перебором;
+- _max_weight_matching находит паросочетание максимального веса;
+- оптимальное распределение не отличается от жадного, если у жадного тот же итог;
+- нормализация, фонетический код и ключи ФИО конвейера по умолчанию и с фонетикой.
+
+Запуск: python -m pytest tests или python tests/test_matching.py
+"""
+import itertools
+from collections import Counter
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+main.wait_for_heavy_modules()
+
+# Нормализация как до настраиваемого конвейера: так результат можно сравнить с исходным перебором
+BASELINE_PIPELINE = {'normalizers': ('lower', 'whitespace'), 'order_insensitive': False, 'phonetic': None}
+PHONETIC_PIPELINE = dict(main.DEFAULT_PIPELINE, phonetic='ru_metaphone')
+
+THRESHOLDS = (0, 30, 50, 67, 80, 85, 90, 95, 100)
+
+SURNAMES = ['Иванов', 'Иваново', 'Ивонов', 'Петров', 'Петрова', 'Ли', 'Ким', 'Сидоров', 'Кузнецов',
+            'Петров-Водкин', 'Оглы', 'Мамедов']
+NAMES = ['Иван', 'Иона', 'Ивaн', 'Пётр', 'Петр', 'Алексей', 'Алекс', 'Сергей', 'Али']
+PATRONYMICS = ['Иванович', 'Иваныч', 'Петрович', 'Сергеевич', 'Алексеевич', 'оглы', 'Гусейн']
+
+
+def random_fio(rng):
+    """Случайное ФИО из 1-4 частей, иногда в верхнем регистре или с опечаткой"""
+    parts = [rng.choice(SURNAMES), rng.choice(NAMES), rng.choice(PATRONYMICS), rng.choice(PATRONYMICS)]
+    fio = ' '.join(parts[:rng.choice([1, 2, 2, 3, 3, 3, 3, 4])])
+    if rng.random() < 0.2:
+        fio = fio.upper()
+    if rng.random() < 0.1:
+        fio = fio.replace('и', 'е', 1)
+    return fio
+
+
+def random_sources(rng, size):
+    """Записи ЗУП (idx, ключи ФИО) и словарь ФИО портала, как их собирает match_records"""
+    zup_entries = []
+    portal_fios_dict = {}
+    for idx in range(size):
+        keys = main.name_keys(random_fio(rng), BASELINE_PIPELINE)
+        if rng.random() < 0.5:
+            zup_entries.append((idx, keys))
+        else:
+            portal_fios_dict[keys['normalized']] = {
+                'original_fio': keys['normalized'],
+                'row_idx': idx,
+                'parts': keys['parts'],
+                'exact_key': keys['exact_key'],
+                'phonetic_key': keys['phonetic_key'],
+            }
+    return zup_entries, portal_fios_dict
+
+
+def source_fios_dict(fios, pipeline):
+    """Словарь ФИО источника, как его собирает build_source_fios_dict"""
+    fios_dict = {}
+    for row_idx, fio in enumerate(fios):
+        keys = main.name_keys(fio, pipeline)
+        fios_dict[keys['normalized']] = {
+            'original_fio': fio,
+            'row_idx': row_idx,
+            'parts': keys['parts'],
+            'exact_key': keys['exact_key'],
+            'phonetic_key': keys['phonetic_key'],
+        }
+    return fios_dict
+
+
+def dense_greedy(zup_entries, portal_fios_dict, threshold):
+    """Исходный алгоритм: точное совпадение, иначе лучшая оценка среди всех оставшихся ФИО портала"""
+    remaining = dict(portal_fios_dict)
+    assignments = {}
+
+    for idx, keys in zup_entries:
+        if keys['normalized'] in remaining:
+            assignments[idx] = (keys['normalized'], 100, True)
+            del remaining[keys['normalized']]
+            continue
+
+        best_score = 0
+        best_key = None
+        for portal_key, portal_data in remaining.items():
+            score = main.score_pair(keys['normalized'], keys['parts'], portal_key, portal_data['parts'])
+            if score is not None and score > best_score:
+                best_score = score
+                best_key = portal_key
+
+        if best_key and best_score >= threshold:
+            assignments[idx] = (best_key, best_score, False)
+            del remaining[best_key]
+
+    return assignments
+
+
+def test_gram_lookup_is_lossless():
+    rng = random.Random(1)
+    strings = [main.normalize_name(random_fio(rng)) for _ in range(400)]
+    index = main.build_gram_index(strings)
+
+    for _ in range(300):
+        text = main.normalize_name(random_fio(rng))
+        min_ratio = rng.choice([0.3, 0.5, 0.67, 0.8, 0.85, 0.9, 0.95, 1.0])
+        found = set(main.gram_lookup(index, text, min_ratio))
+        expected = {pos for pos, string in enumerate(strings)
+                    if main.Levenshtein.ratio(text, string) >= min_ratio}
+        assert expected <= found, (text, min_ratio, [strings[pos] for pos in expected - found])
+
+
+def test_find_candidates_is_lossless():
+    rng = random.Random(2)
+    for _ in range(20):
+        zup_entries, portal_fios_dict = random_sources(rng, rng.randint(20, 150))
+        if not portal_fios_dict:
+            continue
+        candidate_index = main.build_candidate_index(portal_fios_dict)
+
+        for threshold in THRESHOLDS:
+            for _, keys in zup_entries:
+                candidates = set(main.find_candidates(candidate_index, keys['normalized'], keys['parts'], threshold))
+                for portal_key, portal_data in portal_fios_dict.items():
+                    score = main.score_pair(keys['normalized'], keys['parts'], portal_key, portal_data['parts'])
+                    if score is not None and score > 0 and score >= threshold:
+                        assert portal_key in candidates, (keys['normalized'], portal_key, score, threshold)
+
+
+def test_greedy_matches_dense_loop():
+    rng = random.Random(3)
+    for _ in range(30):
+        zup_entries, portal_fios_dict = random_sources(rng, rng.randint(5, 150))
+        if not portal_fios_dict:
+            continue
+        candidate_index = main.build_candidate_index(portal_fios_dict)
+        threshold = rng.choice(THRESHOLDS)
+
+        expected = dense_greedy(zup_entries, portal_fios_dict, threshold)
+        assert main.assign_greedy(zup_entries, portal_fios_dict, candidate_index, threshold) == expected
+
+        # Повтор по сохраненным оценкам пар дает тот же результат
+        scored = main.score_candidates(zup_entries, portal_fios_dict, candidate_index, min(threshold, 50))
+        assert main.assign_greedy(zup_entries, portal_fios_dict, None, threshold, scored=scored) == expected
+
+
+def test_max_weight_matching_is_optimal():
+    rng = random.Random(4)
+    for _ in range(1000):
+        left_size, right_size = rng.randint(1, 5), rng.randint(1, 5)
+        edges = [(left, right, rng.randint(1, 100))
+                 for left in range(left_size) for right in range(right_size) if rng.random() < 0.6]
+        if not edges:
+            continue
+        weights = {(left, right): weight for left, right, weight in edges}
+
+        matching = main._max_weight_matching(edges)
+        assert len(set(matching.values())) == len(matching)
+        assert all((left, right) in weights for left, right in matching.items())
+
+        # Полный перебор: каждой левой вершине - правая вершина или ничего
+        best = 0
+        for choice in itertools.product([None, *range(right_size)], repeat=left_size):
+            used = [right for right in choice if right is not None]
+            if len(used) != len(set(used)):
+                continue
+            if any(right is not None and (left, right) not in weights for left, right in enumerate(choice)):
+                continue
+            best = max(best, sum(weights[(left, right)] for left, right in enumerate(choice) if right is not None))
+
+        assert sum(weights[(left, right)] for left, right in matching.items()) == best, edges
+
+
+def test_optimal_keeps_greedy_on_ties():
+    rng = random.Random(5)
+    ties = 0
+    for _ in range(500):
+        # Оценки пар из двух значений, чтобы было много равноценных распределений
+        zup_entries = [(idx, main.name_keys(f'Иванов{idx}', BASELINE_PIPELINE)) for idx in range(rng.randint(1, 5))]
+        portal_fios_dict = {}
+        for pos in range(rng.randint(1, 5)):
+            keys = main.name_keys(f'Петров{pos}', BASELINE_PIPELINE)
+            portal_fios_dict[keys['normalized']] = {'original_fio': keys['normalized'], 'row_idx': pos, **keys}
+        scored = [{'exact': [], 'phonetic': [],
+                   'fuzzy': [[portal_key, rng.choice([90, 95])] for portal_key in portal_fios_dict if rng.random() < 0.6]}
+                  for _ in zup_entries]
+
+        greedy = main.assign_greedy(zup_entries, portal_fios_dict, None, 85, scored=scored)
+        optimal = main.assign_optimal(zup_entries, portal_fios_dict, None, 85, scored=scored, quiet=True,
+                                      preferred=greedy)
+
+        # Если жадное распределение само оптимально, равноценные перестановки не нужны
+        if sum(score for _, score, _ in greedy.values()) == sum(score for _, score, _ in optimal.values()):
+            ties += 1
+            assert optimal == greedy, scored
+    assert ties
+
+
+def test_normalizers():
+    assert main.normalize_name('  ПЁТР   Иванов ') == 'петр иванов'
+    assert main.normalize_name('Петр Иванов', ('lower', 'whitespace')) == 'петр иванов'
+    assert main.normalize_name(None) == ''
+
+    # Латинские двойники заменяются только в словах с кириллицей
+    assert main._normalize_latin('ивaнов иван') == 'иванов иван'
+    assert main._normalize_latin('john ивaнов') == 'john иванов'
+
+    assert main._normalize_hyphens('петров – водкин') == 'петров-водкин'
+    assert main._normalize_hyphens('петров - водкин иван') == 'петров-водкин иван'
+    assert main._normalize_hyphens('петров‑водкин') == 'петров-водкин'
+
+
+def test_ru_metaphone():
+    assert main.ru_metaphone('Шварц') == main.ru_metaphone('Шворц') == 'шварц'
+    assert main.ru_metaphone('Иванов') == main.ru_metaphone('Ивонов') == 'иванаф'
+    assert main.ru_metaphone('Алексей') == main.ru_metaphone('Олексей')
+    # Оглушение на конце слова
+    assert main.ru_metaphone('Зуб') == main.ru_metaphone('Зуп')
+    assert main.ru_metaphone('Сергеевич') != main.ru_metaphone('Сергеевоч')
+    assert main.ru_metaphone('Smith') == ''
+
+
+def test_name_keys():
+    keys = main.name_keys('Иванов Иван Иванович', main.DEFAULT_PIPELINE)
+    reordered = main.name_keys('Иван Иванович Иванов', main.DEFAULT_PIPELINE)
+    assert keys['exact_key'] == reordered['exact_key']
+    assert keys['parts'] == ['иванов', 'иван', 'иванович']
+    assert keys['phonetic_key'] is None
+
+    assert (main.name_keys('Иванов Иван', BASELINE_PIPELINE)['exact_key'] !=
+            main.name_keys('Иван Иванов', BASELINE_PIPELINE)['exact_key'])
+
+    assert (main.name_keys('Шварц Алексей', PHONETIC_PIPELINE)['phonetic_key'] ==
+            main.name_keys('Алексей Шворц', PHONETIC_PIPELINE)['phonetic_key'])
+    # Без кириллицы фонетического ключа нет
+    assert main.name_keys('John Smith', PHONETIC_PIPELINE)['phonetic_key'] is None
+
+
+def test_default_pipeline_exact_matches():
+    zup_fios = ['Пётр Иванов Сергеевич', 'Ивaнов Иван Петрович', 'Сергеев Олег Иванович',
+                'Петров-Водкин Кузьма Сергеевич', 'Кузнецов Андрей Олегович']
+    portal_fios = ['Петр Иванов Сергеевич', 'Иванов Иван Петрович', 'Олег Иванович Сергеев',
+                   'Петров — Водкин Кузьма Сергеевич', 'Смирнов Андрей Олегович']
+    df = main.pd.DataFrame({'ФИО': zup_fios + portal_fios, 'источник': ['ЗУП'] * 5 + ['портал'] * 5})
+
+    final_df, summary = main.match_records(df, 85)
+
+    zups = final_df[final_df['источник'] == 'ЗУП']
+    assert list(zups['статус_совпадения']) == ['Полное совпадение'] * 4 + ['Совпадений не найдено']
+    assert summary['statuses']['портал'] == {'Нет в ЗУП': 1}
+
+
+def test_phonetic_stage():
+    zup_entries = [(0, main.name_keys('Шварц Алексей Сергеевич', PHONETIC_PIPELINE))]
+    # У первого ФИО оценка выше, но другой фонетический ключ
+    portal_fios_dict = source_fios_dict(['Шварц Алексей Сергеевоч', 'Шворц Алексей Сергеевич'], PHONETIC_PIPELINE)
+    candidate_index = main.build_candidate_index(portal_fios_dict)
+
+    stats = Counter()
+    assignments = main.assign_greedy(zup_entries, portal_fios_dict, candidate_index, 85, stats)
+    assert assignments[0][0] == 'шворц алексей сергеевич'
+    assert stats['phonetic'] == 1 and stats['fuzzy'] == 0
+
+    # Фонетическое совпадение ниже порога уступает нечеткому
+    stats = Counter()
+    assignments = main.assign_greedy(zup_entries, portal_fios_dict, candidate_index, 95, stats)
+    assert assignments[0][0] == 'шварц алексей сергеевоч'
+    assert stats['fuzzy'] == 1 and stats['phonetic'] == 0
+
+    # Без фонетики выбирается лучшая оценка
+    zup_entries = [(0, main.name_keys('Шварц Алексей Сергеевич', main.DEFAULT_PIPELINE))]
+    portal_fios_dict = source_fios_dict(['Шварц Алексей Сергеевоч', 'Шворц Алексей Сергеевич'], main.DEFAULT_PIPELINE)
+    stats = Counter()
+    assignments = main.assign_greedy(zup_entries, portal_fios_dict, main.build_candidate_index(portal_fios_dict),
+                                     85, stats)
+    assert assignments[0][0] == 'шварц алексей сергеевоч'
+    assert stats['fuzzy'] == 1 and stats['phonetic'] == 0
+
+
+if __name__ == '__main__':
+    for test in (test_gram_lookup_is_lossless, test_find_candidates_is_lossless,
+                 test_greedy_matches_dense_loop, test_max_weight_matching_is_optimal,
+                 test_optimal_keeps_greedy_on_ties, test_normalizers, test_ru_metaphone, test_name_keys,
+                 test_default_pipeline_exact_matches, test_phonetic_stage):
+        test()
+        print(f"{test.__name__}: ok")